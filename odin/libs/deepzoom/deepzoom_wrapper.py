@@ -17,43 +17,76 @@
 #  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 #  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from openslide import OpenSlide
-from openslide.deepzoom import DeepZoomGenerator
-from openslide.lowlevel import OpenSlideUnsupportedFormatError
+from openslide import PROPERTY_NAME_BOUNDS_X, PROPERTY_NAME_BOUNDS_Y
 
 import os
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+try:
+    import simplejson as json
+except ImportError:
+    import json
+from math import ceil, log
 from cStringIO import StringIO
 from PIL import Image
+import numpy as np
+import cv2
 
-from odin.libs.deepzoom.errors import DZILevelOutOfBounds, DZIBadTileAddress, UnsupportedFormatError,\
-    MissingFileError
+from odin.libs.deepzoom.errors import DZILevelOutOfBounds, DZIBadTileAddress
+from odin.libs.deepzoom.tiles_cache import get_shared_cache
+from odin.libs.deepzoom.slides_pool import get_shared_pool
 
 
 class DeepZoomWrapper(object):
 
-    def __init__(self, image_path, tile_size, tile_overlap=0, limit_bounds=True):
-        try:
-            slide = OpenSlide(image_path)
-        except OpenSlideUnsupportedFormatError:
-            if os.path.isfile(image_path):
-                raise UnsupportedFormatError()
-            else:
-                raise MissingFileError()
-        self.dzi_wrapper = DeepZoomGenerator(slide, tile_size=tile_size, overlap=tile_overlap,
-                                             limit_bounds=limit_bounds)
+    def __init__(self, image_path, tile_size, tile_overlap=0, limit_bounds=True, tiles_cache=None,
+                 slides_pool=None):
         self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.limit_bounds = limit_bounds
+        self.image_path = os.path.realpath(image_path)
+        # when no cache or pool are given, the ones shared by all the wrappers of the process are used
+        self.tiles_cache = tiles_cache if tiles_cache is not None else get_shared_cache()
+        self.slides_pool = slides_pool if slides_pool is not None else get_shared_pool()
+        with self.slides_pool.lease_slide(self.image_path) as slide:
+            self._l0_offset = self._get_l0_offset(slide, limit_bounds)
+        self._max_zoom_level = self.dzi_wrapper.level_count
+        # scale factors between the highest resolution level and each level, indexed by level
+        self._levels_scale_factors = [None] + [float(pow(2, self._max_zoom_level - level))
+                                               for level in xrange(1, self._max_zoom_level + 1)]
+        self._materialized_levels = dict()
+        self._tissue_indexes = dict()
+
+    # slides are fetched from the pool on every access, if the pool closed the slide it will be opened again; reads
+    # must go through slides_pool.lease_slide, otherwise the pool may close the slide while it is being read
+    @property
+    def slide(self):
+        return self.slides_pool.get_slide(self.image_path)
+
+    @property
+    def dzi_wrapper(self):
+        return self.slides_pool.get_deepzoom_generator(self.image_path, self.tile_size, self.tile_overlap,
+                                                       self.limit_bounds)
+
+    @staticmethod
+    def _get_l0_offset(slide, limit_bounds):
+        if limit_bounds:
+            return int(slide.properties.get(PROPERTY_NAME_BOUNDS_X, 0)), \
+                   int(slide.properties.get(PROPERTY_NAME_BOUNDS_Y, 0))
+        else:
+            return 0, 0
 
     def _check_level(self, level):
         if level > self.get_max_zoom_level() or level < 1:
             raise DZILevelOutOfBounds('Level %d not valid (valid range is 1-%d)' % (level, self.get_max_zoom_level()))
 
     def get_max_zoom_level(self):
-        return self.dzi_wrapper.level_count
+        return self._max_zoom_level
 
     def _scale_to_level(self, value, level):
         self._check_level(level)
-        scale_factor = float(pow(2, self.get_max_zoom_level() - level))
-        return value / scale_factor
+        return value / self._levels_scale_factors[level]
 
     def scale_point_to_level(self, x, y, level):
         self._check_level(level)
@@ -92,24 +125,341 @@ class DeepZoomWrapper(object):
             'y_max': int(y_max / self.tile_size)
         }
 
+    # polygons_bounds is a (N, 4) array with x_min, y_min, x_max, y_max for each row, returns the grid bounds of
+    # each polygon using the same layout
+    def get_polygons_grid_bounds(self, polygons_bounds, level):
+        self._check_level(level)
+        polygons_bounds = np.asarray(polygons_bounds, dtype=np.float64) / self._levels_scale_factors[level]
+        return np.floor(polygons_bounds / self.tile_size).astype(np.int64)
+
+    # points is a (N, 2) array of (x, y) coordinates of the highest resolution level
+    def scale_points_to_level(self, points, level):
+        self._check_level(level)
+        return np.asarray(points, dtype=np.float64) / self._levels_scale_factors[level]
+
+    # points is a (N, 2) array of (x, y) coordinates of the given level, returns the (column, row) of the tile
+    # containing each point and the offset of the point inside the tile
+    def get_tiles_by_points(self, points, level):
+        self._check_level(level)
+        points = np.asarray(points, dtype=np.float64)
+        tiles = np.floor(points / self.tile_size).astype(np.int64)
+        return tiles, points - tiles * self.tile_size
+
+    # map (N, 2) points of the highest resolution level to points, tiles and in-tile offsets of the given level
+    def map_points_to_level(self, points, level):
+        level_points = self.scale_points_to_level(points, level)
+        tiles, offsets = self.get_tiles_by_points(level_points, level)
+        return level_points, tiles, offsets
+
     def get_tile_coordinates(self, level, column, row):
         return self.dzi_wrapper.get_tile_coordinates(level-1, (column, row))
 
     def get_tile_size(self):
         return self.tile_size
 
-    def get_tile(self, level, column, row, format='jpeg', quality=90):
-        self._check_level(level)
-        try:
-            tile = self.dzi_wrapper.get_tile(level-1, (column, row))
-        except ValueError:
+    def _get_tile_cache_key(self, level, column, row):
+        return self.image_path, self.tile_size, self.tile_overlap, self.limit_bounds, level, column, row
+
+    def _get_tile_box(self, level, column, row):
+        grid = self.get_level_grid(level)
+        if not (0 <= column < grid['columns'] and 0 <= row < grid['rows']):
             raise DZIBadTileAddress('Invalid address (%d, %d) for level %d' % (column, row, level - 1))
+        resolution = self.get_level_resolution(level)
+        x_min = column * self.tile_size - self.tile_overlap * int(column != 0)
+        y_min = row * self.tile_size - self.tile_overlap * int(row != 0)
+        x_max = min((column + 1) * self.tile_size, resolution['width']) + \
+            self.tile_overlap * int(column != grid['columns'] - 1)
+        y_max = min((row + 1) * self.tile_size, resolution['height']) + \
+            self.tile_overlap * int(row != grid['rows'] - 1)
+        return x_min, y_min, x_max, y_max
+
+    def _get_materialized_tile(self, level, column, row):
+        x_min, y_min, x_max, y_max = self._get_tile_box(level, column, row)
+        return self._materialized_levels[level][y_min:y_max, x_min:x_max]
+
+    def get_raw_tile(self, level, column, row):
+        self._check_level(level)
+        if level in self._materialized_levels:
+            return Image.fromarray(self._get_materialized_tile(level, column, row))
+        cache_key = self._get_tile_cache_key(level, column, row)
+        tile = self.tiles_cache.get(cache_key)
+        if tile is None:
+            try:
+                with self.slides_pool.lease_deepzoom_generator(self.image_path, self.tile_size, self.tile_overlap,
+                                                               self.limit_bounds) as dzi_wrapper:
+                    tile = dzi_wrapper.get_tile(level-1, (column, row))
+            except ValueError:
+                raise DZIBadTileAddress('Invalid address (%d, %d) for level %d' % (column, row, level - 1))
+            self.tiles_cache.put(cache_key, tile)
+        return tile
+
+    def get_tiles_cache_stats(self):
+        return self.tiles_cache.get_stats()
+
+    def get_tile_array(self, level, column, row):
+        if level in self._materialized_levels:
+            return self._get_materialized_tile(level, column, row)
+        return np.asarray(self.get_raw_tile(level, column, row), dtype=np.uint8)
+
+    def get_encoded_tile(self, level, column, row, format='jpeg', quality=90):
+        tile = self.get_raw_tile(level, column, row)
         tile_buffer = StringIO()
         tile.save(tile_buffer, format=format, quality=quality)
+        return tile_buffer.getvalue()
+
+    # if format is None the decoded tile is returned as it is, without going through an encode/decode step
+    def get_tile(self, level, column, row, format='jpeg', quality=90):
+        if format is None:
+            return self.get_raw_tile(level, column, row)
+        tile_buffer = StringIO(self.get_encoded_tile(level, column, row, format, quality))
         return Image.open(tile_buffer)
 
+    # fill a (N, H, W, 3) array with the tiles whose (column, row) addresses are listed in coordinates, tiles on the
+    # borders of the slide are padded in place using the background value
+    def get_tiles(self, level, coordinates, out=None, background=255):
+        full_tile_size = self.tile_size + 2 * self.tile_overlap
+        if out is None:
+            out = np.empty((len(coordinates), full_tile_size, full_tile_size, 3), dtype=np.uint8)
+        for i, (column, row) in enumerate(coordinates):
+            tile = self.get_tile_array(level, column, row)
+            out[i, :tile.shape[0], :tile.shape[1]] = tile
+            out[i, tile.shape[0]:] = background
+            out[i, :tile.shape[0], tile.shape[1]:] = background
+        return out
+
     def get_tile_by_point(self, level, point, format='jpeg', quality=90):
         point_row = int(point[1] / self.tile_size)
         point_column = int(point[0] / self.tile_size)
         return self.get_tile(level, point_column, point_row, format, quality), \
                (point_column, point_row)
+
+    def _get_native_level(self, level):
+        self._check_level(level)
+        downsample = float(pow(2, self.get_max_zoom_level() - level))
+        with self.slides_pool.lease_slide(self.image_path) as slide:
+            native_level = slide.get_best_level_for_downsample(downsample)
+            return native_level, downsample, slide.level_downsamples[native_level]
+
+    # x, y, width and height are expressed using the coordinates system of the given DeepZoom level, the area of
+    # the window that falls outside the level is filled with the background color
+    def read_region(self, level, x, y, width, height, background=(255, 255, 255)):
+        return self.read_regions([(level, x, y, width, height)], background)[0]
+
+    # windows is a list of (level, x, y, width, height) tuples, windows served by the same native level are read
+    # from the slide with a single read of their union
+    def read_regions(self, windows, background=(255, 255, 255)):
+        regions = list()
+        native_windows = dict()
+        for i, (level, x, y, width, height) in enumerate(windows):
+            if level in self._materialized_levels:
+                regions.append(Image.fromarray(self.read_region_array(level, x, y, width, height, background)))
+                continue
+            native_level, downsample, native_downsample = self._get_native_level(level)
+            level_resolution = self.get_level_resolution(level)
+            x, y, width, height = int(x), int(y), int(width), int(height)
+            regions.append(Image.new('RGB', (width, height), background))
+            x_min, y_min = max(x, 0), max(y, 0)
+            x_max, y_max = min(x + width, level_resolution['width']), min(y + height, level_resolution['height'])
+            if x_max <= x_min or y_max <= y_min:
+                continue
+            native_windows.setdefault((native_level, native_downsample), []).append({
+                'region_index': i,
+                'offset': (x_min - x, y_min - y),
+                'size': (x_max - x_min, y_max - y_min),
+                'l0_box': (x_min * downsample, y_min * downsample, x_max * downsample, y_max * downsample)
+            })
+        for (native_level, native_downsample), level_windows in native_windows.iteritems():
+            l0_x = int(min(w['l0_box'][0] for w in level_windows))
+            l0_y = int(min(w['l0_box'][1] for w in level_windows))
+            native_size = (
+                int(ceil((max(w['l0_box'][2] for w in level_windows) - l0_x) / native_downsample)),
+                int(ceil((max(w['l0_box'][3] for w in level_windows) - l0_y) / native_downsample))
+            )
+            with self.slides_pool.lease_slide(self.image_path) as slide:
+                native_region = slide.read_region((self._l0_offset[0] + l0_x, self._l0_offset[1] + l0_y),
+                                                  native_level, native_size)
+            for w in level_windows:
+                native_box = (
+                    (w['l0_box'][0] - l0_x) / native_downsample,
+                    (w['l0_box'][1] - l0_y) / native_downsample,
+                    (w['l0_box'][2] - l0_x) / native_downsample,
+                    (w['l0_box'][3] - l0_y) / native_downsample
+                )
+                if native_box == (0, 0) + native_region.size and native_region.size == w['size']:
+                    window_region = native_region
+                else:
+                    window_region = native_region.resize(w['size'], Image.ANTIALIAS, box=native_box)
+                regions[w['region_index']].paste(window_region, w['offset'], window_region)
+        return regions
+
+    def read_region_array(self, level, x, y, width, height, background=(255, 255, 255)):
+        try:
+            level_array = self._materialized_levels[level]
+        except KeyError:
+            return np.asarray(self.read_region(level, x, y, width, height, background), dtype=np.uint8)
+        x, y, width, height = int(x), int(y), int(width), int(height)
+        x_min, y_min = max(x, 0), max(y, 0)
+        x_max, y_max = min(x + width, level_array.shape[1]), min(y + height, level_array.shape[0])
+        if (x_min, y_min, x_max, y_max) == (x, y, x + width, y + height):
+            return level_array[y_min:y_max, x_min:x_max]
+        region = np.empty((height, width, 3), dtype=np.uint8)
+        region[:] = background
+        if x_max > x_min and y_max > y_min:
+            region[y_min - y:y_max - y, x_min - x:x_max - x] = level_array[y_min:y_max, x_min:x_max]
+        return region
+
+    def _get_level_cache_paths(self, level, cache_folder):
+        cache_label = '%s_L%d' % (os.path.basename(self.image_path), level)
+        if not self.limit_bounds:
+            cache_label += '_full'
+        return os.path.join(cache_folder, '%s.npy' % cache_label), os.path.join(cache_folder, '%s.json' % cache_label)
+
+    def _get_slide_signature(self):
+        slide_stats = os.stat(self.image_path)
+        return {
+            'size': slide_stats.st_size,
+            'mtime': slide_stats.st_mtime
+        }
+
+    def _write_level_cache(self, level, array_path, stripe_height):
+        resolution = self.get_level_resolution(level)
+        tmp_array_path = '%s.tmp.npy' % array_path[:-4]
+        level_array = np.lib.format.open_memmap(tmp_array_path, mode='w+', dtype=np.uint8,
+                                                shape=(resolution['height'], resolution['width'], 3))
+        for y in xrange(0, resolution['height'], stripe_height):
+            stripe_height = min(stripe_height, resolution['height'] - y)
+            level_array[y:y + stripe_height] = self.read_region_array(level, 0, y, resolution['width'],
+                                                                      stripe_height)
+        level_array.flush()
+        del level_array
+        os.rename(tmp_array_path, array_path)
+
+    # write the whole level into a .npy file (if there is no valid copy of it in cache_folder) and serve all the
+    # following reads of the level from the memory-mapped file, the cached copy is rebuilt if size or
+    # modification time of the slide file change
+    def materialize_level(self, level, cache_folder, stripe_height=1024):
+        self._check_level(level)
+        array_path, info_path = self._get_level_cache_paths(level, cache_folder)
+        slide_signature = self._get_slide_signature()
+        try:
+            with open(info_path) as f:
+                cache_info = json.loads(f.read())
+        except (IOError, ValueError):
+            cache_info = None
+        if cache_info != slide_signature or not os.path.isfile(array_path):
+            self._materialized_levels.pop(level, None)
+            try:
+                os.remove(info_path)
+            except OSError:
+                pass
+            self._write_level_cache(level, array_path, stripe_height)
+            with open(info_path, 'w') as f:
+                f.write(json.dumps(slide_signature))
+        self._materialized_levels[level] = np.load(array_path, mmap_mode='r')
+        return self._materialized_levels[level]
+
+    def release_level(self, level):
+        self._materialized_levels.pop(level, None)
+
+    def _get_tissue_index_source_level(self, level):
+        # each pixel of the source level averages about 4x4 pixels of the target level
+        return max(level - 2, 1)
+
+    @staticmethod
+    def _get_tissue_bound(white_lower_bound, pixel_size):
+        # a source pixel averaging pixel_size x pixel_size target pixels is below this bound if at least one of them
+        # is below white_lower_bound, so a tile is marked as background only if all of its pixels are white; one more
+        # grey level is allowed for the rounding of the averages done by each level of the pyramid
+        return 256 - (255 - white_lower_bound) / float(pixel_size * pixel_size)
+
+    @staticmethod
+    def _get_covered_cells(pixels_count, pixel_size, cell_size, cells_count):
+        pixels = np.arange(pixels_count)
+        first_cells = np.minimum((pixels * pixel_size) // cell_size, cells_count - 1)
+        last_cells = np.minimum(((pixels + 1) * pixel_size - 1) // cell_size, cells_count - 1)
+        return first_cells, last_cells
+
+    # build a (rows, columns) boolean grid for the given level where False marks tiles that are only background in a
+    # lower resolution version of the slide, the source level is read in stripes of stripe_height rows and margin cells
+    # around each tissue tile are also kept as tissue
+    def get_tissue_index(self, level, white_lower_bound=230, margin=1, stripe_height=1024):
+        self._check_level(level)
+        index_key = (level, white_lower_bound, margin)
+        try:
+            return self._tissue_indexes[index_key]
+        except KeyError:
+            pass
+        source_level = self._get_tissue_index_source_level(level)
+        source_resolution = self.get_level_resolution(source_level)
+        grid = self.get_level_grid(level)
+        pixel_size = pow(2, level - source_level)
+        tissue_bound = self._get_tissue_bound(white_lower_bound, pixel_size)
+        first_columns, last_columns = self._get_covered_cells(source_resolution['width'], pixel_size, self.tile_size,
+                                                              grid['columns'])
+        first_rows, last_rows = self._get_covered_cells(source_resolution['height'], pixel_size, self.tile_size,
+                                                        grid['rows'])
+        rows_mask = np.zeros((grid['rows'], source_resolution['width']), dtype=np.bool)
+        for y in xrange(0, source_resolution['height'], stripe_height):
+            height = min(stripe_height, source_resolution['height'] - y)
+            stripe = self.read_region_array(source_level, 0, y, source_resolution['width'], height)
+            tissue_mask = np.any(stripe < tissue_bound, axis=-1)
+            np.logical_or.at(rows_mask, first_rows[y:y + height], tissue_mask)
+            np.logical_or.at(rows_mask, last_rows[y:y + height], tissue_mask)
+        tissue_index = np.zeros((grid['columns'], grid['rows']), dtype=np.bool)
+        np.logical_or.at(tissue_index, first_columns, rows_mask.T)
+        np.logical_or.at(tissue_index, last_columns, rows_mask.T)
+        tissue_index = tissue_index.T
+        if margin > 0:
+            kernel = np.ones((2 * margin + 1, 2 * margin + 1), dtype=np.uint8)
+            tissue_index = cv2.dilate(tissue_index.astype(np.uint8), kernel).astype(np.bool)
+        self._tissue_indexes[index_key] = tissue_index
+        return tissue_index
+
+    def get_tissue_tiles(self, level, white_lower_bound=230, margin=1):
+        tissue_index = self.get_tissue_index(level, white_lower_bound, margin)
+        return [(column, row) for row, column in zip(*np.nonzero(tissue_index))]
+
+    def _get_region_tiles(self, level, region, order):
+        grid = self.get_level_grid(level)
+        if region is None:
+            region = {
+                'x_min': 0,
+                'x_max': grid['columns'] - 1,
+                'y_min': 0,
+                'y_max': grid['rows'] - 1
+            }
+        columns = xrange(max(region['x_min'], 0), min(region['x_max'], grid['columns'] - 1) + 1)
+        rows = xrange(max(region['y_min'], 0), min(region['y_max'], grid['rows'] - 1) + 1)
+        if order == 'row':
+            return [(column, row) for row in rows for column in columns]
+        elif order == 'column':
+            return [(column, row) for column in columns for row in rows]
+        else:
+            raise ValueError('Unsupported tiles order %s' % order)
+
+    # yield ((column, row), tile) tuples in a deterministic order while a pool of threads reads the next prefetch
+    # tiles, region uses the same format of get_polygon_grid_bounds; the iteration stops when the generator is
+    # closed or when cancel_event is set
+    def iter_tiles(self, level, region=None, order='row', prefetch=16, workers=4, as_array=False,
+                   skip_background=False, cancel_event=None):
+        self._check_level(level)
+        tiles_coordinates = self._get_region_tiles(level, region, order)
+        if skip_background:
+            tissue_index = self.get_tissue_index(level)
+            tiles_coordinates = [(column, row) for column, row in tiles_coordinates if tissue_index[row, column]]
+        read_tile = self.get_tile_array if as_array else self.get_raw_tile
+        tiles_coordinates = iter(tiles_coordinates)
+        workers_pool = ThreadPool(processes=workers)
+        pending_tiles = deque()
+        try:
+            for column, row in islice(tiles_coordinates, max(prefetch, 1)):
+                pending_tiles.append(((column, row), workers_pool.apply_async(read_tile, (level, column, row))))
+            while pending_tiles:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                tile_coordinates, tile = pending_tiles.popleft()
+                for column, row in islice(tiles_coordinates, 1):
+                    pending_tiles.append(((column, row), workers_pool.apply_async(read_tile, (level, column, row))))
+                yield tile_coordinates, tile.get()
+        finally:
+            workers_pool.terminate()
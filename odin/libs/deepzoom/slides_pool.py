@@ -0,0 +1,203 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from openslide import OpenSlide
+from openslide.deepzoom import DeepZoomGenerator
+from openslide.lowlevel import OpenSlideUnsupportedFormatError
+
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+from odin.libs.deepzoom.errors import UnsupportedFormatError, MissingFileError
+
+DEFAULT_MAX_OPEN_FILES = 64
+
+
+class SlidesPool(object):
+
+    # open slides are kept until the file descriptors they hold exceed max_open_files, then the least recently used
+    # ones are closed; slides can be leased (see lease_slide and lease_deepzoom_generator) and a leased slide is
+    # never closed until all its leases are released, even if this takes the pool above the limit for a while
+    def __init__(self, max_open_files=DEFAULT_MAX_OPEN_FILES):
+        self.max_open_files = max_open_files
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._slides = OrderedDict()
+        self._slides_files = dict()
+        self._generators = dict()
+        self._leases = dict()
+        self._pending_closes = set()
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        # OpenSlide handles can't be shared with forked processes, a child process starts with an empty pool
+        if os.getpid() != self._pid:
+            self._reset()
+
+    # None if the open file descriptors of the process can't be listed
+    @staticmethod
+    def _count_open_files():
+        try:
+            return len(os.listdir('/proc/self/fd'))
+        except OSError:
+            return None
+
+    @staticmethod
+    def _open_slide(slide_path):
+        try:
+            return OpenSlide(slide_path)
+        except OpenSlideUnsupportedFormatError:
+            if os.path.isfile(slide_path):
+                raise UnsupportedFormatError()
+            else:
+                raise MissingFileError()
+
+    def _close_slide(self, slide_path):
+        slide = self._slides.pop(slide_path)
+        self._slides_files.pop(slide_path)
+        for k in [k for k in self._generators if k[0] == slide_path]:
+            self._generators.pop(k)
+        self._pending_closes.discard(slide_path)
+        slide.close()
+
+    def _get_open_files(self):
+        return sum(self._slides_files.itervalues())
+
+    # closes the least recently used slides that are not leased (apart from keep) until the limit is respected
+    def _release_files(self, keep=None):
+        for slide_path in [p for p in self._slides if not self._leases.get(p) and p != keep]:
+            if self._get_open_files() <= self.max_open_files:
+                break
+            self._close_slide(slide_path)
+
+    def _get_slide(self, slide_path):
+        self._check_process()
+        try:
+            slide = self._slides.pop(slide_path)
+        except KeyError:
+            open_files = self._count_open_files()
+            slide = self._open_slide(slide_path)
+            # the descriptors opened by OpenSlide for the slide, each slide counts at least as one
+            if open_files is None:
+                slide_files = 1
+            else:
+                slide_files = max(self._count_open_files() - open_files, 1)
+            self._slides_files[slide_path] = slide_files
+        # (re)insert the slide in order to mark it as the most recently used one
+        self._slides[slide_path] = slide
+        self._release_files(keep=slide_path)
+        return slide
+
+    def _get_deepzoom_generator(self, slide_path, tile_size, tile_overlap, limit_bounds):
+        slide = self._get_slide(slide_path)
+        generator_key = (slide_path, tile_size, tile_overlap, limit_bounds)
+        try:
+            return self._generators[generator_key]
+        except KeyError:
+            generator = DeepZoomGenerator(slide, tile_size=tile_size, overlap=tile_overlap,
+                                          limit_bounds=limit_bounds)
+            self._generators[generator_key] = generator
+            return generator
+
+    # the slide returned can be closed by the pool at any time, use lease_slide to read from it
+    def get_slide(self, slide_path):
+        with self._lock:
+            return self._get_slide(slide_path)
+
+    def get_deepzoom_generator(self, slide_path, tile_size, tile_overlap=0, limit_bounds=True):
+        with self._lock:
+            return self._get_deepzoom_generator(slide_path, tile_size, tile_overlap, limit_bounds)
+
+    def _acquire(self, slide_path):
+        self._leases[slide_path] = self._leases.get(slide_path, 0) + 1
+
+    def _release(self, slide_path):
+        with self._lock:
+            self._check_process()
+            if slide_path not in self._leases:
+                return
+            self._leases[slide_path] -= 1
+            if self._leases[slide_path] == 0:
+                self._leases.pop(slide_path)
+                if slide_path in self._pending_closes:
+                    self._close_slide(slide_path)
+                else:
+                    self._release_files()
+
+    @contextmanager
+    def lease_slide(self, slide_path):
+        with self._lock:
+            slide = self._get_slide(slide_path)
+            self._acquire(slide_path)
+        try:
+            yield slide
+        finally:
+            self._release(slide_path)
+
+    @contextmanager
+    def lease_deepzoom_generator(self, slide_path, tile_size, tile_overlap=0, limit_bounds=True):
+        with self._lock:
+            generator = self._get_deepzoom_generator(slide_path, tile_size, tile_overlap, limit_bounds)
+            self._acquire(slide_path)
+        try:
+            yield generator
+        finally:
+            self._release(slide_path)
+
+    # leased slides are closed when their last lease is released
+    def close(self, slide_path):
+        with self._lock:
+            self._check_process()
+            if self._leases.get(slide_path):
+                self._pending_closes.add(slide_path)
+            elif slide_path in self._slides:
+                self._close_slide(slide_path)
+
+    def close_all(self):
+        with self._lock:
+            self._check_process()
+            for slide_path in self._slides.keys():
+                if self._leases.get(slide_path):
+                    self._pending_closes.add(slide_path)
+                else:
+                    self._close_slide(slide_path)
+
+    def get_open_slides(self):
+        with self._lock:
+            self._check_process()
+            return self._slides.keys()
+
+    def get_open_files(self):
+        with self._lock:
+            self._check_process()
+            return self._get_open_files()
+
+
+_SHARED_POOL = None
+
+
+def get_shared_pool():
+    global _SHARED_POOL
+    if _SHARED_POOL is None:
+        _SHARED_POOL = SlidesPool()
+    return _SHARED_POOL
@@ -0,0 +1,99 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from collections import OrderedDict
+from threading import Lock
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Pillow stores single band images with one byte per pixel (two for I;16), multi-band
+# images like RGB and RGBA, as well as I and F ones, with four bytes per pixel
+PIXEL_SIZES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2}
+
+
+class TilesCache(object):
+
+    # cached tiles are shared between all the callers, they must be treated as read-only objects
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_usage = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _get_tile_memory(tile):
+        return tile.width * tile.height * PIXEL_SIZES.get(tile.mode, 4)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                tile, tile_memory = self._tiles.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # reinsert the tile in order to mark it as the most recently used one
+            self._tiles[key] = (tile, tile_memory)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        tile_memory = self._get_tile_memory(tile)
+        if tile_memory > self.memory_budget:
+            return
+        with self._lock:
+            try:
+                _, old_tile_memory = self._tiles.pop(key)
+                self.memory_usage -= old_tile_memory
+            except KeyError:
+                pass
+            while self._tiles and self.memory_usage + tile_memory > self.memory_budget:
+                _, (_, evicted_memory) = self._tiles.popitem(last=False)
+                self.memory_usage -= evicted_memory
+                self.evictions += 1
+            self._tiles[key] = (tile, tile_memory)
+            self.memory_usage += tile_memory
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.memory_usage = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'tiles': len(self._tiles),
+                'memory_usage': self.memory_usage,
+                'memory_budget': self.memory_budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+_SHARED_CACHE = None
+
+
+def get_shared_cache():
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = TilesCache()
+    return _SHARED_CACHE
@@ -0,0 +1,105 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import tempfile
+import numpy as np
+import cv2
+
+from odin.libs.patches.patches_extractor import PatchesExtractor
+
+TISSUE_LABEL = 1
+TUMOR_LABEL = 2
+NOT_TUMOR_LABEL = 4
+
+# rasters bigger than this (in pixels) are stored in a memory mapped temporary file
+MEMMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+class LabelsRaster(object):
+
+    # the core and its focus regions are rasterised once at the given scale level into a single uint8 raster, each
+    # pixel stores the labels covering it as bits; masks of the patches are then extracted as slices of the raster.
+    # The raster covers the bounding box of all the shapes, so focus regions crossing the border of the core are
+    # drawn whole like in the masks built from the shapes
+    def __init__(self, core, positive_regions, negative_regions, patch_size, scale_level=0, cache_folder=None,
+                 memmap_threshold=MEMMAP_THRESHOLD):
+        self.patch_size = patch_size
+        self.scale_level = scale_level
+        core_path = self._get_path(core)
+        positive_paths = [self._get_path(region) for region in positive_regions]
+        negative_paths = [self._get_path(region) for region in negative_regions]
+        paths = np.concatenate([core_path] + positive_paths + negative_paths)
+        self.origin = np.floor(paths.min(axis=0)).astype(np.int64)
+        width, height = (np.floor(paths.max(axis=0)).astype(np.int64) - self.origin) + 1
+        self.raster = self._allocate(height, width, cache_folder, memmap_threshold)
+        self._fill(core_path, TISSUE_LABEL)
+        for path in positive_paths:
+            self._fill(path, TUMOR_LABEL)
+        for path in negative_paths:
+            self._fill(path, NOT_TUMOR_LABEL)
+
+    def _get_path(self, shape):
+        return np.array(shape.get_coordinates(self.scale_level))[:, :2]
+
+    @staticmethod
+    def _allocate(height, width, cache_folder, memmap_threshold):
+        if height * width > memmap_threshold:
+            # the temporary file is removed as soon as the memmap is released
+            return np.memmap(tempfile.TemporaryFile(dir=cache_folder), dtype=np.uint8, mode='w+',
+                             shape=(height, width))
+        else:
+            return np.zeros((height, width), dtype=np.uint8)
+
+    # regions are drawn in a buffer as big as their bounding box (clipped to the raster) that is then OR-ed into
+    # the raster
+    def _fill(self, path, label):
+        path = np.floor(path).astype(np.int64) - self.origin
+        x_min, y_min = np.maximum(path.min(axis=0), 0)
+        x_max = min(path[:, 0].max(), self.raster.shape[1] - 1)
+        y_max = min(path[:, 1].max(), self.raster.shape[0] - 1)
+        if x_min > x_max or y_min > y_max:
+            return
+        region_mask = np.zeros((y_max - y_min + 1, x_max - x_min + 1), dtype=np.uint8)
+        cv2.fillPoly(region_mask, [(path - (x_min, y_min)).astype(np.int32)], label)
+        self.raster[y_min:y_max + 1, x_min:x_max + 1] |= region_mask
+
+    # the box is snapped to the pixels read by the PatchesExtractor for the same coordinates
+    def get_labels(self, box):
+        x, y = np.array(PatchesExtractor.get_patch_origin(box)) - self.origin
+        width = height = self.patch_size
+        labels = np.zeros((height, width), dtype=np.uint8)
+        src_x, src_y = max(x, 0), max(y, 0)
+        src_x_max = min(x + width, self.raster.shape[1])
+        src_y_max = min(y + height, self.raster.shape[0])
+        if src_x < src_x_max and src_y < src_y_max:
+            labels[src_y - y:src_y_max - y, src_x - x:src_x_max - x] = self.raster[src_y:src_y_max, src_x:src_x_max]
+        return labels
+
+    def get_masks(self, box):
+        labels = self.get_labels(box)
+        tissue = (labels & TISSUE_LABEL).astype(np.bool_)
+        return {
+            'tissue': tissue.astype(np.uint8),
+            'not_tissue': (~tissue).astype(np.uint8),
+            'tumor': ((labels & TUMOR_LABEL) > 0).astype(np.uint8),
+            'not_tumor': ((labels & NOT_TUMOR_LABEL) > 0).astype(np.uint8)
+        }
+
+    def close(self):
+        self.raster = None
@@ -0,0 +1,56 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import numpy as np
+
+from odin.libs.regions_of_interest.shapes_manager import ShapesIndex
+
+MASKS_PLANES = ('tissue', 'not_tissue', 'tumor', 'not_tumor')
+
+
+class PatchMasksBuilder(object):
+
+    # builds the tissue, not_tissue, tumor and not_tumor masks of a patch in a single pass, each shape is drawn
+    # directly into its plane of a buffer allocated once; positive and negative regions are looked up in a spatial
+    # index and the ones whose envelope doesn't overlap the patch are skipped without any geometric operation
+    def __init__(self, core, positive_regions, negative_regions, patch_size, scale_level=0):
+        self.core = core
+        self.scale_level = scale_level
+        self.planes = [MASKS_PLANES.index('tumor')] * len(positive_regions) + \
+                      [MASKS_PLANES.index('not_tumor')] * len(negative_regions)
+        self.regions_index = ShapesIndex(list(positive_regions) + list(negative_regions), scale_level)
+        self.masks = np.zeros((len(MASKS_PLANES), patch_size, patch_size), dtype=np.uint8)
+
+    def _get_overlapping_regions(self, box):
+        return [(self.regions_index.shapes[i], self.planes[i]) for i in self.regions_index.query(box)]
+
+    # returns a (4, P, P) array with the planes in MASKS_PLANES order; the array is the builder's own buffer and it is
+    # overwritten by the next call, callers that keep the masks must copy them
+    def build(self, box):
+        self.masks[:] = 0
+        self.core.fill_intersection_mask(self.masks[0], box, self.scale_level)
+        np.subtract(1, self.masks[0], out=self.masks[1])
+        for region, plane in self._get_overlapping_regions(box):
+            region.fill_intersection_mask(self.masks[plane], box, self.scale_level)
+        return self.masks
+
+    # unlike build, the returned masks are copies and stay valid after the next call
+    def get_masks(self, box):
+        masks = self.build(box).copy()
+        return dict((label, masks[i]) for i, label in enumerate(MASKS_PLANES))
@@ -17,6 +17,11 @@
 #  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 #  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
 import numpy as np
 import cv2
 from PIL import Image
@@ -46,6 +51,73 @@ def remove_mask(mask_1, mask_2):
     return np.uint8(result)
 
 
+# binary masks with the same shape are stored as a single array with the bit-packed planes, masks with a single
+# value only store the value (VALUE_PACKED marks the packed planes)
+PACKED_MASKS_ENCODING = 'packed'
+VALUE_PACKED = -1
+
+
+def encode_masks(masks):
+    labels = sorted(masks)
+    shape = np.asarray(masks[labels[0]]).shape
+    values = list()
+    packed_planes = list()
+    for label in labels:
+        mask = np.asarray(masks[label])
+        if mask.shape != shape:
+            raise ValueError('mask %s has shape %r, expected %r' % (label, mask.shape, shape))
+        min_value, max_value = mask.min(), mask.max()
+        if min_value == max_value:
+            values.append(int(min_value))
+        elif min_value == 0 and max_value == 1:
+            values.append(VALUE_PACKED)
+            packed_planes.append(mask.astype(np.bool_))
+        else:
+            raise ValueError('mask %s is not a binary mask' % label)
+    header = {
+        'encoding': PACKED_MASKS_ENCODING,
+        'labels': labels,
+        'shape': list(shape),
+        'values': values
+    }
+    return {
+        'header': np.array(json.dumps(header)),
+        'bits': np.packbits(np.array(packed_planes, dtype=np.bool_), axis=None)
+    }
+
+
+def decode_masks(encoded):
+    header = json.loads(str(encoded['header']))
+    shape = tuple(header['shape'])
+    plane_size = int(np.prod(shape))
+    bits = np.unpackbits(encoded['bits'])
+    masks = dict()
+    packed_index = 0
+    for label, value in zip(header['labels'], header['values']):
+        if value == VALUE_PACKED:
+            masks[str(label)] = bits[packed_index * plane_size:(packed_index + 1) * plane_size].reshape(shape)
+            packed_index += 1
+        else:
+            masks[str(label)] = np.full(shape, value, dtype=np.uint8)
+    return masks
+
+
+def save_masks(out_file, masks):
+    np.savez_compressed(out_file, **encode_masks(masks))
+
+
+# loads both the masks saved with save_masks and plain NPZ files with one array for each mask
+def load_masks(masks_file):
+    data = np.load(masks_file)
+    try:
+        if 'header' in data.files and 'bits' in data.files:
+            return decode_masks(data)
+        else:
+            return dict((k, data[k]) for k in data.files)
+    finally:
+        data.close()
+
+
 def extract_contours(mask):
     _, contours, _ = cv2.findContours(mask, mode=cv2.RETR_EXTERNAL,
                                       method=cv2.CHAIN_APPROX_SIMPLE)
@@ -0,0 +1,173 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import re
+from csv import DictWriter
+import numpy as np
+
+from odin.libs.patches.patches_extractor import PatchesExtractor
+
+MASKS_LABELS = ('tissue', 'not_tissue', 'tumor', 'not_tumor', 'cv2_white')
+INDEX_FIELDS = ['shard', 'offset', 'slide_id', 'core_id', 'focus_region_id', 'patch_uuid', 'x', 'y']
+
+
+class PatchesDatasetWriter(object):
+
+    # patches of a slide are appended to fixed-shape .npy shards, (N, P, P, 3) for the patches and (N, 5, P, P) for
+    # the masks (stored in MASKS_LABELS order, not written if with_masks is False); if context_scales_count is
+    # greater than 0 the context patches sharing the center of each patch are stored in (N, S, P, P, 3) shards. The
+    # index file maps each patch to its shard and offset
+    def __init__(self, output_folder, slide_id, patch_size, shard_size=1024, with_masks=True,
+                 context_scales_count=0):
+        self.output_folder = os.path.join(output_folder, slide_id)
+        self.slide_id = slide_id
+        self.patch_size = patch_size
+        self.shard_size = shard_size
+        self.with_masks = with_masks
+        self.context_scales_count = context_scales_count
+        try:
+            os.makedirs(self.output_folder)
+        except OSError:
+            pass
+        self.index_file = os.path.join(self.output_folder, 'patches_index.csv')
+        self._shard_id = self._get_next_shard_id()
+        self._patches = None
+        self._masks = None
+        self._context = None
+        self._shard_count = 0
+        self._index_rows = list()
+
+    def _get_next_shard_id(self):
+        shards = [int(m.group(1)) for m in
+                  (re.match(r'^patches_(\d+)\.npy$', f) for f in os.listdir(self.output_folder)) if m]
+        return max(shards) + 1 if shards else 0
+
+    def _get_shard_files(self, shard_id):
+        return os.path.join(self.output_folder, 'patches_%05d.npy' % shard_id), \
+               os.path.join(self.output_folder, 'masks_%05d.npy' % shard_id), \
+               os.path.join(self.output_folder, 'context_%05d.npy' % shard_id)
+
+    def _open_shard(self):
+        patches_file, masks_file, context_file = self._get_shard_files(self._shard_id)
+        self._patches = np.lib.format.open_memmap(patches_file, mode='w+', dtype=np.uint8,
+                                                  shape=(self.shard_size, self.patch_size, self.patch_size, 3))
+        if self.with_masks:
+            self._masks = np.lib.format.open_memmap(masks_file, mode='w+', dtype=np.uint8,
+                                                    shape=(self.shard_size, len(MASKS_LABELS), self.patch_size,
+                                                           self.patch_size))
+        if self.context_scales_count > 0:
+            self._context = np.lib.format.open_memmap(context_file, mode='w+', dtype=np.uint8,
+                                                      shape=(self.shard_size, self.context_scales_count,
+                                                             self.patch_size, self.patch_size, 3))
+        self._shard_count = 0
+
+    @staticmethod
+    def _truncate_shard(shard_file, shard, count):
+        truncated_file = '%s.tmp.npy' % shard_file[:-4]
+        truncated_shard = np.lib.format.open_memmap(truncated_file, mode='w+', dtype=shard.dtype,
+                                                    shape=(count,) + shard.shape[1:])
+        truncated_shard[:] = shard[:count]
+        truncated_shard.flush()
+        del truncated_shard
+        os.rename(truncated_file, shard_file)
+
+    def _close_shard(self):
+        if self._patches is None:
+            return
+        self._patches.flush()
+        if self._masks is not None:
+            self._masks.flush()
+        if self._context is not None:
+            self._context.flush()
+        if self._shard_count < self.shard_size:
+            patches_file, masks_file, context_file = self._get_shard_files(self._shard_id)
+            self._truncate_shard(patches_file, self._patches, self._shard_count)
+            if self._masks is not None:
+                self._truncate_shard(masks_file, self._masks, self._shard_count)
+            if self._context is not None:
+                self._truncate_shard(context_file, self._context, self._shard_count)
+        self._patches = None
+        self._masks = None
+        self._context = None
+        self._shard_id += 1
+
+    # context is the (S, P, P, 3) array of the context patches, required if context_scales_count is greater than 0
+    def append(self, patch, masks, patch_uuid, core_id, focus_region_id, coordinates, context=None):
+        if self._patches is None:
+            self._open_shard()
+        self._patches[self._shard_count] = np.asarray(patch, dtype=np.uint8)
+        if self._masks is not None:
+            for i, label in enumerate(MASKS_LABELS):
+                self._masks[self._shard_count, i] = masks[label]
+        if self._context is not None:
+            self._context[self._shard_count] = context
+        x, y = PatchesExtractor.get_patch_origin(coordinates)
+        self._index_rows.append({
+            'shard': self._shard_id,
+            'offset': self._shard_count,
+            'slide_id': self.slide_id,
+            'core_id': core_id,
+            'focus_region_id': focus_region_id,
+            'patch_uuid': patch_uuid,
+            'x': x,
+            'y': y
+        })
+        self._shard_count += 1
+        if self._shard_count == self.shard_size:
+            self._close_shard()
+
+    # index rows are written only when the patches they refer to have been written to the shards
+    def flush(self):
+        if self._patches is not None:
+            self._patches.flush()
+        if self._masks is not None:
+            self._masks.flush()
+        if self._context is not None:
+            self._context.flush()
+        write_header = not os.path.isfile(self.index_file)
+        with open(self.index_file, 'a') as ofile:
+            writer = DictWriter(ofile, INDEX_FIELDS)
+            if write_header:
+                writer.writeheader()
+            for row in self._index_rows:
+                writer.writerow(row)
+        self._index_rows = list()
+
+    def close(self):
+        self._close_shard()
+        self.flush()
+
+
+# masks are None if the dataset was written without them
+def load_patches_dataset(slide_folder, shard_id, mmap_mode='r'):
+    masks_file = os.path.join(slide_folder, 'masks_%05d.npy' % shard_id)
+    if os.path.isfile(masks_file):
+        masks = np.load(masks_file, mmap_mode=mmap_mode)
+    else:
+        masks = None
+    return np.load(os.path.join(slide_folder, 'patches_%05d.npy' % shard_id), mmap_mode=mmap_mode), masks
+
+
+# the (N, S, P, P, 3) array of the context patches of a shard, None if the dataset was written without them
+def load_context_patches(slide_folder, shard_id, mmap_mode='r'):
+    context_file = os.path.join(slide_folder, 'context_%05d.npy' % shard_id)
+    if os.path.isfile(context_file):
+        return np.load(context_file, mmap_mode=mmap_mode)
+    return None
@@ -0,0 +1,91 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+from csv import DictReader, DictWriter
+from cStringIO import StringIO
+
+JOURNAL_FIELDS = ['slide_id', 'core_id', 'focus_region_id', 'status']
+
+
+class ExtractionJournal(object):
+
+    # append-only log of the (slide, core, focus region) units that have been completely processed, each line is
+    # synced to disk before the next unit is started so that a restarted run can skip completed units. Units skipped
+    # because of invalid shapes or missing classifications are logged with their status, so that they are not loaded
+    # again by a restarted run
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self._completed = self._load()
+
+    def _load(self):
+        completed = set()
+        if os.path.isfile(self.journal_file):
+            with open(self.journal_file, 'r+') as f:
+                content = f.read()
+                # drop a partially written last line (crash while writing it)
+                if content and not content.endswith('\n'):
+                    content = content[:content.rfind('\n') + 1]
+                    f.truncate(len(content))
+            reader = DictReader(StringIO(content))
+            rows = list(reader)
+            for row in rows:
+                completed.add((row['slide_id'], row['core_id'], row['focus_region_id']))
+            if reader.fieldnames is not None and reader.fieldnames != JOURNAL_FIELDS:
+                self._upgrade(rows)
+        return completed
+
+    # journals written before the status column was added only list completed units
+    def _upgrade(self, rows):
+        tmp_journal_file = '%s.tmp' % self.journal_file
+        with open(tmp_journal_file, 'w') as ofile:
+            writer = DictWriter(ofile, JOURNAL_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({
+                    'slide_id': row['slide_id'],
+                    'core_id': row['core_id'],
+                    'focus_region_id': row['focus_region_id'],
+                    'status': row.get('status') or 'completed'
+                })
+            ofile.flush()
+            os.fsync(ofile.fileno())
+        os.rename(tmp_journal_file, self.journal_file)
+
+    def is_completed(self, slide_id, core_id, focus_region_id):
+        return (slide_id, core_id, focus_region_id) in self._completed
+
+    def mark_completed(self, slide_id, core_id, focus_region_id, status='completed'):
+        write_header = not os.path.isfile(self.journal_file) or os.path.getsize(self.journal_file) == 0
+        with open(self.journal_file, 'a') as ofile:
+            writer = DictWriter(ofile, JOURNAL_FIELDS)
+            if write_header:
+                writer.writeheader()
+            writer.writerow({
+                'slide_id': slide_id,
+                'core_id': core_id,
+                'focus_region_id': focus_region_id,
+                'status': status
+            })
+            ofile.flush()
+            os.fsync(ofile.fileno())
+        self._completed.add((slide_id, core_id, focus_region_id))
+
+    def get_completed_count(self):
+        return len(self._completed)
@@ -17,16 +17,17 @@
 #  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 #  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from PIL import Image
+import numpy as np
 
 from odin.libs.patches.errors import InvalidScaleFactor
 
 
 class PatchesExtractor(object):
 
-    def __init__(self, dzi_wrapper):
+    # if patch_size is not specified, patches will have the same size of the DeepZoom tiles
+    def __init__(self, dzi_wrapper, patch_size=None):
         self.slide_wrapper = dzi_wrapper
-        self.tiles_cache = dict()
+        self.patch_size = patch_size or dzi_wrapper.get_tile_size()
 
     def _get_scale_level(self, scale_factor):
         max_level = self.slide_wrapper.get_max_zoom_level()
@@ -38,94 +39,90 @@ class PatchesExtractor(object):
     def _get_patch_coordinates(self, center, scale_factor):
         center = self.slide_wrapper.scale_point_to_level(center[0], center[1],
                                                          self._get_scale_level(scale_factor))
-        tile_size = self.slide_wrapper.get_tile_size()
-        upper_left_x = center[0] - tile_size/2
-        upper_left_y = center[1] - tile_size/2
+        return self._get_patch_vertices(center[0] - self.patch_size/2, center[1] - self.patch_size/2)
+
+    # centers is a (N, 2) array of points of the highest resolution level, returns the (N, 2) array of the upper left
+    # vertices of the patches
+    def _get_patches_coordinates(self, centers, scale_factor):
+        centers = self.slide_wrapper.scale_points_to_level(centers, self._get_scale_level(scale_factor))
+        return centers - self.patch_size / 2
+
+    def _get_patch_vertices(self, upper_left_x, upper_left_y):
         return {
             'up_left': (upper_left_x, upper_left_y),
-            'down_left': (upper_left_x, upper_left_y + tile_size),
-            'down_right': (upper_left_x + tile_size, upper_left_y + tile_size),
-            'up_right': (upper_left_x + tile_size, upper_left_y)
+            'down_left': (upper_left_x, upper_left_y + self.patch_size),
+            'down_right': (upper_left_x + self.patch_size, upper_left_y + self.patch_size),
+            'up_right': (upper_left_x + self.patch_size, upper_left_y)
         }
 
-    def _load_tile(self, point, scale_factor):
-        if point not in self.tiles_cache:
-            level = self._get_scale_level(scale_factor)
-            tile, grid_coordinates = self.slide_wrapper.get_tile_by_point(level, point)
-            self.tiles_cache[grid_coordinates] = tile
-            return grid_coordinates
+    # patches are read starting from the pixel of the level nearest to their upper left vertex, use this to get
+    # the integer origin of a patch returned by the extractor
+    @staticmethod
+    def get_patch_origin(patch_vertices):
+        x, y = PatchesExtractor.get_patches_origins(patch_vertices['up_left'])
+        return int(x), int(y)
 
-    def _get_patch_grid(self, patch_vertices, scale_factor):
-        patch_grid = dict()
-        for k, v in patch_vertices.iteritems():
-            patch_grid[k] = self._load_tile(v, scale_factor)
-        # clean the grid
-        if patch_grid['down_right'] == patch_grid['down_left'] or patch_grid['down_right'] == patch_grid['up_right']:
-            patch_grid.pop('down_right')
-        if patch_grid['down_left'] == patch_grid['up_left']:
-            patch_grid.pop('down_left')
-        if patch_grid['up_right'] == patch_grid['up_left']:
-            patch_grid.pop('up_right')
-        return patch_grid
+    # upper_left_vertices is a (N, 2) array, returns the (N, 2) array of the origins of the patches
+    @staticmethod
+    def get_patches_origins(upper_left_vertices):
+        return np.floor(np.asarray(upper_left_vertices) + 0.5).astype(np.int64)
 
-    def _get_context_img_resolution(self, patch_grid):
-        width, height = self.tiles_cache[patch_grid['up_left']].size
-        try:
-            width += self.tiles_cache[patch_grid['up_right']].width
-        except KeyError:
-            pass
-        try:
-            height += self.tiles_cache[patch_grid['down_right']].height
-        except KeyError:
-            pass
-        return width, height
+    def get_patch(self, patch_center, scale_factor=0):
+        patch_vertices = self._get_patch_coordinates(patch_center, scale_factor)
+        origin_x, origin_y = self.get_patch_origin(patch_vertices)
+        patch = self.slide_wrapper.read_region(self._get_scale_level(scale_factor), origin_x, origin_y,
+                                               self.patch_size, self.patch_size)
+        return patch, patch_vertices
 
-    def _get_context_img(self, patch_grid):
-        tile_size = self.slide_wrapper.get_tile_size()
-        context_img_width, context_img_height = self._get_context_img_resolution(patch_grid)
-        context_img = Image.new('RGB', (context_img_width, context_img_height))
-        context_img.paste(self.tiles_cache[patch_grid['up_left']], (0, 0))
-        try:
-            context_img.paste(self.tiles_cache[patch_grid['up_right']], (tile_size, 0))
-        except KeyError:
-            pass
-        try:
-            context_img.paste(self.tiles_cache[patch_grid['down_left']], (0, tile_size))
-        except KeyError:
-            pass
-        try:
-            context_img.paste(self.tiles_cache[patch_grid['down_right']], (tile_size, tile_size))
-        except KeyError:
-            pass
-        return context_img
+    # build a pyramid of patches sharing the same center, one for each scale factor, returned as a (S, P, P, 3)
+    # array where P is the patch size; scale factors served by the same native level of the slide share a single
+    # read of the slide
+    def get_patch_pyramid(self, patch_center, scale_factors):
+        patches_vertices = [self._get_patch_coordinates(patch_center, sf) for sf in scale_factors]
+        windows = [(self._get_scale_level(sf),) + self.get_patch_origin(pv) + (self.patch_size, self.patch_size)
+                   for sf, pv in zip(scale_factors, patches_vertices)]
+        patches = np.empty((len(windows), self.patch_size, self.patch_size, 3), dtype=np.uint8)
+        for i, patch in enumerate(self.slide_wrapper.read_regions(windows)):
+            patches[i] = np.asarray(patch)
+        return patches, patches_vertices
 
-    def _new_patch_coordinates(self, patch_vertices):
+    def _group_patches_by_tile(self, patches_origins, level):
         tile_size = self.slide_wrapper.get_tile_size()
-        new_up_left = (
-            patch_vertices['up_left'][0] % tile_size,
-            patch_vertices['up_left'][1] % tile_size
-            )
-        new_patch_grid = {
-            'up_left': new_up_left,
-            'down_left': (new_up_left[0], new_up_left[1] + tile_size),
-            'down_right': (new_up_left[0] + tile_size, new_up_left[1] + tile_size),
-            'up_right': (new_up_left[0] + tile_size, new_up_left[1])
-        }
-        return new_patch_grid
+        grid = self.slide_wrapper.get_level_grid(level)
+        first_tiles = np.maximum(patches_origins // tile_size, 0)
+        last_tiles = np.minimum((patches_origins + self.patch_size - 1) // tile_size,
+                                [grid['columns'] - 1, grid['rows'] - 1])
+        tiles_patches = dict()
+        for i in xrange(len(patches_origins)):
+            for column in xrange(first_tiles[i][0], last_tiles[i][0] + 1):
+                for row in xrange(first_tiles[i][1], last_tiles[i][1] + 1):
+                    tiles_patches.setdefault((column, row), []).append(i)
+        return tiles_patches
 
-    def _extract_patch(self, context_image, patch_vertices):
+    # centers is a (N, 2) array of points of the highest resolution level, patches are returned as a (N, P, P, 3)
+    # array where P is the patch size; each tile touched by the patches is read only once and the areas of the
+    # patches outside the slide are filled with white
+    def get_patches(self, centers, scale_factor=0):
+        if len(centers) == 0:
+            return np.empty((0, self.patch_size, self.patch_size, 3), dtype=np.uint8), []
+        level = self._get_scale_level(scale_factor)
         tile_size = self.slide_wrapper.get_tile_size()
-        patch_ctx_coordinates = self._new_patch_coordinates(patch_vertices)
-        cropped_image = context_image.crop((
-            patch_ctx_coordinates['up_left'][0],
-            patch_ctx_coordinates['up_left'][1],
-            patch_ctx_coordinates['up_left'][0] + tile_size,
-            patch_ctx_coordinates['up_left'][1] + tile_size
-        ))
-        return cropped_image
-
-    def get_patch(self, patch_center, scale_factor=0):
-        patch_vertices = self._get_patch_coordinates(patch_center, scale_factor)
-        patch_grid = self._get_patch_grid(patch_vertices, scale_factor)
-        context_image = self._get_context_img(patch_grid)
-        return self._extract_patch(context_image, patch_vertices), patch_vertices
+        tile_overlap = self.slide_wrapper.tile_overlap
+        upper_left_vertices = self._get_patches_coordinates(centers, scale_factor)
+        patches_origins = self.get_patches_origins(upper_left_vertices)
+        patches = np.empty((len(patches_origins), self.patch_size, self.patch_size, 3), dtype=np.uint8)
+        patches[:] = 255
+        tiles_patches = self._group_patches_by_tile(patches_origins, level)
+        for column, row in sorted(tiles_patches, key=lambda t: (t[1], t[0])):
+            tile = self.slide_wrapper.get_tile_array(level, column, row)
+            tile_x = column * tile_size - tile_overlap * int(column != 0)
+            tile_y = row * tile_size - tile_overlap * int(row != 0)
+            for i in tiles_patches[(column, row)]:
+                patch_x, patch_y = patches_origins[i]
+                x_min = max(patch_x, column * tile_size)
+                y_min = max(patch_y, row * tile_size)
+                x_max = min(patch_x + self.patch_size, (column + 1) * tile_size, tile_x + tile.shape[1])
+                y_max = min(patch_y + self.patch_size, (row + 1) * tile_size, tile_y + tile.shape[0])
+                patches[i, y_min - patch_y:y_max - patch_y, x_min - patch_x:x_max - patch_x] = \
+                    tile[y_min - tile_y:y_max - tile_y, x_min - tile_x:x_max - tile_x]
+        return patches, [self._get_patch_vertices(x, y) for x, y in upper_left_vertices]
@@ -28,7 +28,13 @@ def extract_white_mask(patch_img, lower_bound):
     cv2_img = cv2.cvtColor(np.array(patch_img), cv2.COLOR_RGB2BGR)
     white_mask = cv2.inRange(cv2_img, np.array([lower_bound, lower_bound, lower_bound], dtype=np.uint8),
                              np.array([255, 255, 255], dtype=np.uint8))
-    return white_mask / 255
+    return white_mask // 255
+
+
+# tiles is a (N, H, W, 3) array, returns the fraction of white pixels of each tile
+def get_white_percentages(tiles, lower_bound):
+    white_mask = np.all(tiles >= lower_bound, axis=-1)
+    return white_mask.mean(axis=(1, 2))
 
 
 def apply_mask(patch_img, mask, mask_color, mask_alpha=None):
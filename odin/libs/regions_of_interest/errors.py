@@ -19,3 +19,7 @@
 
 class InvalidPolygonError(Exception):
     pass
+
+
+class TriangulationError(Exception):
+    pass
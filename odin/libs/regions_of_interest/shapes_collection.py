@@ -0,0 +1,123 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import numpy as np
+import cv2
+
+from errors import InvalidPolygonError
+from shapes_manager import Shape
+
+# maximum number of (point, edge) couples evaluated at once by contains_points
+MAX_CHECKS_CHUNK = 4 * 1024 * 1024
+
+
+class ShapeCollection(object):
+
+    # the vertices of all the polygons are stored in a single (V, 2) array, the vertices of the i-th polygon are
+    # coordinates[offsets[i]:offsets[i + 1]]; Shape objects are only built when a geometric operation needs them
+    __slots__ = ('coordinates', 'offsets', '_shapes')
+
+    def __init__(self, polygons, shapes=None):
+        vertices = list()
+        for polygon in polygons:
+            polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+            if len(polygon) > 1 and np.array_equal(polygon[0], polygon[-1]):
+                polygon = polygon[:-1]
+            if len(polygon) < 3:
+                raise InvalidPolygonError()
+            vertices.append(polygon)
+        self.offsets = np.cumsum([0] + [len(v) for v in vertices]).astype(np.int64)
+        if vertices:
+            self.coordinates = np.concatenate(vertices)
+        else:
+            self.coordinates = np.empty((0, 2), dtype=np.float64)
+        self._shapes = list(shapes) if shapes is not None else [None] * len(vertices)
+
+    @classmethod
+    def from_shapes(cls, shapes):
+        shapes = list(shapes)
+        return cls([s.get_coordinates() for s in shapes], shapes)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.get_shape(index)
+
+    def get_shape(self, index):
+        if self._shapes[index] is None:
+            self._shapes[index] = Shape(self.get_coordinates(index))
+        return self._shapes[index]
+
+    def get_coordinates(self, index, scale_level=0):
+        return self.coordinates[self.offsets[index]:self.offsets[index + 1]] * pow(2, scale_level)
+
+    def _get_next_vertices(self):
+        next_vertices = np.arange(1, len(self.coordinates) + 1)
+        next_vertices[self.offsets[1:] - 1] = self.offsets[:-1]
+        return next_vertices
+
+    # returns a (N, 4) array with x_min, y_min, x_max, y_max of each polygon
+    def get_bounds(self, scale_level=0):
+        if len(self) == 0:
+            return np.empty((0, 4), dtype=np.float64)
+        starts = self.offsets[:-1]
+        bounds = np.column_stack((
+            np.minimum.reduceat(self.coordinates[:, 0], starts),
+            np.minimum.reduceat(self.coordinates[:, 1], starts),
+            np.maximum.reduceat(self.coordinates[:, 0], starts),
+            np.maximum.reduceat(self.coordinates[:, 1], starts)
+        ))
+        return bounds * pow(2, scale_level)
+
+    def get_areas(self, scale_level=0):
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float64)
+        x, y = self.coordinates[:, 0], self.coordinates[:, 1]
+        next_vertices = self._get_next_vertices()
+        cross = x * y[next_vertices] - x[next_vertices] * y
+        return np.abs(np.add.reduceat(cross, self.offsets[:-1])) / 2.0 * pow(4, scale_level)
+
+    # diameters of the minimum enclosing circles, computed like Shape.get_length
+    def get_lengths(self, scale_level=0):
+        lengths = np.empty(len(self), dtype=np.float64)
+        for i in xrange(len(self)):
+            _, radius = cv2.minEnclosingCircle(self.get_coordinates(i, scale_level).astype(int))
+            lengths[i] = radius * 2
+        return lengths
+
+    # even-odd test of (M, 2) points against all the polygons, returns a (M, N) boolean array
+    def contains_points(self, points, scale_level=0):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2) / pow(2, scale_level)
+        inside = np.zeros((len(points), len(self)), dtype=np.bool_)
+        if len(self) == 0 or len(points) == 0:
+            return inside
+        a = self.coordinates
+        b = self.coordinates[self._get_next_vertices()]
+        # horizontal edges never cross the ray, their slope is not used
+        dy = np.where(b[:, 1] != a[:, 1], b[:, 1] - a[:, 1], 1.0)
+        slopes = (b[:, 0] - a[:, 0]) / dy
+        chunk_size = max(MAX_CHECKS_CHUNK // len(a), 1)
+        for start in xrange(0, len(points), chunk_size):
+            px = points[start:start + chunk_size, 0:1]
+            py = points[start:start + chunk_size, 1:2]
+            crossing = ((a[:, 1] > py) != (b[:, 1] > py)) & (px < a[:, 0] + (py - a[:, 1]) * slopes)
+            inside[start:start + chunk_size] = np.add.reduceat(crossing.astype(np.int32), self.offsets[:-1],
+                                                               axis=1) % 2 == 1
+        return inside
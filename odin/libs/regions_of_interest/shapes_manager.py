@@ -23,19 +23,29 @@ except ImportError:
 #  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from errors import InvalidPolygonError
+from utils import triangulate_polygon, get_triangles_areas, sample_triangles, repair_polygon, fill_polygon_stripe
 
-from random import randint
 from requests import codes as rc
-from shapely.geometry import Polygon, Point, MultiPolygon
+from shapely.geometry import Polygon, Point
 from shapely.affinity import scale
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+from shapely.ops import unary_union
+from collections import OrderedDict
 import numpy as np
 import cv2
 
 
 class Shape(object):
 
+    MAX_CACHED_POLYGONS = 8
+
+    # polygons are validated and repaired once when the shape is created, raises InvalidPolygonError if the points
+    # don't enclose any area
     def __init__(self, segments):
-        self.polygon = Polygon(segments)
+        self.polygon = repair_polygon(segments)
+        self._triangles = None
+        self._polygons_cache = OrderedDict()
 
     def get_bounds(self):
         bounds = self.polygon.bounds
@@ -50,24 +60,15 @@ class Shape(object):
             raise InvalidPolygonError()
 
     def get_coordinates(self, scale_level=0):
-        if scale_level != 0:
-            polygon = self._rescale_polygon(scale_level)
-        else:
-            polygon = self.polygon
+        polygon = self._get_polygon(scale_level)
         return list(polygon.exterior.coords)
 
     def get_area(self, scale_level=0):
-        if scale_level != 0:
-            polygon = self._rescale_polygon(scale_level)
-        else:
-            polygon = self.polygon
+        polygon = self._get_polygon(scale_level)
         return polygon.area
 
     def get_length(self, scale_level=0):
-        if scale_level != 0:
-            polygon = self._rescale_polygon(scale_level)
-        else:
-            polygon = self.polygon
+        polygon = self._get_polygon(scale_level)
         polygon_path = np.array(polygon.exterior.coords[:])
         _, radius = cv2.minEnclosingCircle(polygon_path.astype(int))
         return radius*2
@@ -89,22 +90,22 @@ class Shape(object):
         yM = y_max if not y_max is None else bounds['y_max']
         return [(xm, ym), (xM, ym), (xM, yM), (xm, yM)]
 
-    def get_random_point(self):
-        bounds = self.get_bounds()
-        point = Point(
-            randint(int(bounds['x_min']), int(bounds['x_max'])),
-            randint(int(bounds['y_min']), int(bounds['y_max']))
-        )
-        while not self.polygon.contains(point):
-            point = Point(
-                randint(int(bounds['x_min']), int(bounds['x_max'])),
-                randint(int(bounds['y_min']), int(bounds['y_max']))
-            )
-        return point
-
-    def get_random_points(self, points_count):
-        points = [self.get_random_point() for _ in xrange(points_count)]
-        return points
+    def _get_triangles(self):
+        if self._triangles is None:
+            triangles = triangulate_polygon(self.polygon.exterior.coords)
+            self._triangles = (triangles, get_triangles_areas(triangles))
+        return self._triangles
+
+    # uniform sampling of points_count points inside the polygon, returned as a (points_count, 2) array
+    def sample_points(self, points_count, seed=None):
+        triangles, areas = self._get_triangles()
+        return sample_triangles(triangles, points_count, np.random.RandomState(seed), areas)
+
+    def get_random_point(self, seed=None):
+        return self.get_random_points(1, seed)[0]
+
+    def get_random_points(self, points_count, seed=None):
+        return [Point(x, y) for x, y in self.sample_points(points_count, seed)]
 
     def _box_to_polygon(self, box):
         return Polygon([box['down_left'], box['down_right'], box['up_right'], box['up_left']])
@@ -113,56 +114,180 @@ class Shape(object):
         scaling = pow(2, scale_level)
         return scale(self.polygon, xfact=scaling, yfact=scaling, origin=(0, 0))
 
-    def get_intersection_mask(self, box, scale_level=0, tolerance=0):
-        if scale_level != 0:
-            polygon = self._rescale_polygon(scale_level)
-        else:
-            polygon = self.polygon
-        if tolerance > 0:
-            polygon = polygon.simplify(tolerance, preserve_topology=False)
-        box_polygon = self._box_to_polygon(box)
-        box_height = int(box['down_left'][1] - box['up_left'][1])
-        box_width = int(box['down_right'][0] - box['down_left'][0])
-        if not polygon.intersects(box_polygon):
-            return np.zeros((box_width, box_height), dtype=np.uint8)
-        else:
-            if polygon.contains(box_polygon):
-                return np.ones((box_width, box_height), dtype=np.uint8)
+    # rescaled and simplified polygons are kept in a small LRU memo keyed by scale level and tolerance, together
+    # with their prepared geometries (built when needed) used to speed up the predicates
+    def _get_cached_polygon(self, scale_level, tolerance):
+        key = (scale_level, tolerance)
+        try:
+            entry = self._polygons_cache.pop(key)
+        except KeyError:
+            if scale_level != 0:
+                polygon = self._rescale_polygon(scale_level)
             else:
-                mask = np.zeros((box_width, box_height), dtype=np.uint8)
-                intersection = polygon.intersection(box_polygon)
-                if type(intersection) is MultiPolygon:
-                    intersection_paths = list(intersection)
-                else:
-                    intersection_paths = [intersection]
-                for path in intersection_paths:
-                    ipath = path.exterior.coords[:]
-                    ipath = [(int(x - box['up_left'][0]), int(y - box['up_left'][1])) for x, y in ipath]
-                    cv2.fillPoly(mask, np.array([ipath,]), 1)
-                return mask
-
-    def get_full_mask(self, scale_level=0, tolerance=0):
-        if scale_level != 0:
-            polygon = self._rescale_polygon(scale_level)
-            scale_factor = pow(2, scale_level)
+                polygon = self.polygon
+            if tolerance > 0:
+                polygon = polygon.simplify(tolerance, preserve_topology=False)
+            entry = [polygon, None]
+        self._polygons_cache[key] = entry
+        if len(self._polygons_cache) > self.MAX_CACHED_POLYGONS:
+            self._polygons_cache.popitem(last=False)
+        return entry
+
+    def _get_polygon(self, scale_level=0, tolerance=0):
+        return self._get_cached_polygon(scale_level, tolerance)[0]
+
+    def _get_prepared_polygon(self, scale_level=0, tolerance=0):
+        entry = self._get_cached_polygon(scale_level, tolerance)
+        if entry[1] is None:
+            entry[1] = prep(entry[0])
+        return entry[1]
+
+    @staticmethod
+    def _get_polygons(geometry):
+        if isinstance(geometry, Polygon):
+            return [geometry]
+        # MultiPolygon or GeometryCollection, lines and points have no area and are not drawn
+        return [g for g in getattr(geometry, 'geoms', []) if isinstance(g, Polygon)]
+
+    # draws the intersection between the polygon and the box into mask (whose size must match the box) using value,
+    # pixels outside the intersection are not modified so that more shapes can be drawn on the same mask
+    def fill_intersection_mask(self, mask, box, scale_level=0, tolerance=0, value=1):
+        prepared_polygon = self._get_prepared_polygon(scale_level, tolerance)
+        box_polygon = self._box_to_polygon(box)
+        if not prepared_polygon.intersects(box_polygon):
+            return
+        if prepared_polygon.contains(box_polygon):
+            mask[:] = value
         else:
-            polygon = self.polygon
-            scale_factor = 1
-        if tolerance > 0:
-            polygon = polygon.simplify(tolerance, preserve_topology=False)
+            intersection = prepared_polygon.context.intersection(box_polygon)
+            for path in self._get_polygons(intersection):
+                ipath = (np.array(path.exterior.coords)[:, :2] - box['up_left']).astype(np.int32)
+                cv2.fillPoly(mask, [ipath], value)
+
+    def get_intersection_mask(self, box, scale_level=0, tolerance=0):
+        box_height = int(round(box['down_left'][1] - box['up_left'][1]))
+        box_width = int(round(box['down_right'][0] - box['down_left'][0]))
+        mask = np.zeros((box_width, box_height), dtype=np.uint8)
+        self.fill_intersection_mask(mask, box, scale_level, tolerance)
+        return mask
+
+    def _get_full_mask_path(self, scale_level, tolerance):
+        polygon = self._get_polygon(scale_level, tolerance)
+        scale_factor = pow(2, scale_level)
         bounds = self.get_bounds()
         box_height = int((bounds['y_max']-bounds['y_min'])*scale_factor)
         box_width = int((bounds['x_max']-bounds['x_min'])*scale_factor)
-        mask = np.zeros((box_height, box_width), dtype=np.uint8)
-        polygon_path = polygon.exterior.coords[:]
-        polygon_path = [(int(x - bounds['x_min']*scale_factor),
-                         int(y - bounds['y_min']*scale_factor)) for x, y in polygon_path]
-        cv2.fillPoly(mask, np.array([polygon_path, ]), 1)
-        return mask
+        polygon_path = np.array(polygon.exterior.coords)[:, :2] - (bounds['x_min']*scale_factor,
+                                                                   bounds['y_min']*scale_factor)
+        return polygon_path.astype(np.int32), box_height, box_width
+
+    # yields (y_offset, stripe) couples with horizontal bands of the mask (stripe_height rows at most), only a
+    # single band is allocated at a time and bands match the single cv2.fillPoly rasterisation pixel by pixel
+    def iter_full_mask(self, scale_level=0, tolerance=0, stripe_height=1024):
+        polygon_path, box_height, box_width = self._get_full_mask_path(scale_level, tolerance)
+        for y_offset in xrange(0, box_height, stripe_height):
+            stripe = np.zeros((min(stripe_height, box_height - y_offset), box_width), dtype=np.uint8)
+            yield y_offset, fill_polygon_stripe(stripe, polygon_path, y_offset, box_height)
+
+    def get_full_mask_shape(self, scale_level=0):
+        _, box_height, box_width = self._get_full_mask_path(scale_level, 0)
+        return box_height, box_width
+
+    # if out is given (e.g. a memmap with get_full_mask_shape() shape) the mask is written into it one stripe at a
+    # time, otherwise a new array is allocated
+    def get_full_mask(self, scale_level=0, tolerance=0, out=None, stripe_height=1024):
+        if out is None:
+            polygon_path, box_height, box_width = self._get_full_mask_path(scale_level, tolerance)
+            mask = np.zeros((box_height, box_width), dtype=np.uint8)
+            cv2.fillPoly(mask, [polygon_path], 1)
+            return mask
+        for y_offset, stripe in self.iter_full_mask(scale_level, tolerance, stripe_height):
+            out[y_offset:y_offset + stripe.shape[0]] = stripe
+            if isinstance(out, np.memmap):
+                out.flush()
+        return out
+
+    # streams the mask to a .npy file one stripe at a time, returns the mask as a read only memmap
+    def save_full_mask(self, out_file, scale_level=0, tolerance=0, stripe_height=1024):
+        with open(out_file, 'wb') as ofile:
+            np.lib.format.write_array_header_1_0(ofile, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                'fortran_order': False,
+                'shape': self.get_full_mask_shape(scale_level)
+            })
+            for _, stripe in self.iter_full_mask(scale_level, tolerance, stripe_height):
+                ofile.write(stripe.tobytes())
+        return np.load(out_file, mmap_mode='r')
 
     def get_difference_mask(self, box, scale_level=0, tolerance=0):
         return 1 - self.get_intersection_mask(box, scale_level, tolerance)
 
+    def get_coverage_fraction(self, box, scale_level=0):
+        prepared_polygon = self._get_prepared_polygon(scale_level)
+        box_polygon = self._box_to_polygon(box)
+        if not prepared_polygon.intersects(box_polygon):
+            return 0.0
+        elif prepared_polygon.contains(box_polygon):
+            return 1.0
+        else:
+            return prepared_polygon.context.intersection(box_polygon).area / box_polygon.area
+
+    # exact fraction of the area of each box covered by the polygon, computed from the intersection areas without
+    # rasterising any mask
+    def get_coverage_fractions(self, boxes, scale_level=0):
+        return np.array([self.get_coverage_fraction(b, scale_level) for b in boxes], dtype=np.float64)
+
+
+class ShapesIndex(object):
+
+    # STRtree over the envelopes of the polygons of a list of shapes at a given scale level, used to find the shapes
+    # that could overlap a patch without testing all of them
+    def __init__(self, shapes, scale_level=0):
+        self.shapes = list(shapes)
+        self.scale_level = scale_level
+        self._geometries = [s._get_polygon(scale_level) for s in self.shapes]
+        # STRtree.query returns the indexed geometries, they are mapped back to the shapes by identity
+        self._positions = dict((id(g), i) for i, g in enumerate(self._geometries))
+        self._tree = STRtree(self._geometries)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    # indices of the shapes whose envelope overlaps the box, in ascending order
+    def query(self, box):
+        x_min, y_min = box['up_left']
+        x_max, y_max = box['down_right']
+        if not self.shapes:
+            return []
+        return sorted(self._positions[id(g)] for g in self._tree.query(
+            Polygon([(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)])
+        ))
+
+    # fraction of the area of each box covered by the union of the indexed shapes
+    def get_coverage_fractions(self, boxes):
+        fractions = np.zeros(len(boxes), dtype=np.float64)
+        for i, box in enumerate(boxes):
+            candidates = [self.shapes[j] for j in self.query(box)]
+            if len(candidates) == 1:
+                fractions[i] = candidates[0].get_coverage_fraction(box, self.scale_level)
+            elif candidates:
+                box_polygon = candidates[0]._box_to_polygon(box)
+                prepared_polygons = [c._get_prepared_polygon(self.scale_level) for c in candidates]
+                if any(p.contains(box_polygon) for p in prepared_polygons):
+                    fractions[i] = 1.0
+                else:
+                    # overlapping shapes are merged so that shared areas are counted once
+                    fractions[i] = unary_union([p.context.intersection(box_polygon) for p in prepared_polygons
+                                                if p.intersects(box_polygon)]).area / box_polygon.area
+        return fractions
+
+    def query_point(self, x, y):
+        if not self.shapes:
+            return []
+        point = Point(x, y)
+        candidates = sorted(self._positions[id(g)] for g in self._tree.query(point))
+        return [i for i in candidates if self.shapes[i]._get_prepared_polygon(self.scale_level).intersects(point)]
+
 
 class ShapesManager(object):
 
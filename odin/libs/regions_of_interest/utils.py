@@ -0,0 +1,287 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import numpy as np
+import cv2
+from shapely.geometry import Polygon, MultiPolygon, LineString, box
+from shapely.ops import polygonize, unary_union, clip_by_rect
+
+from errors import InvalidPolygonError, TriangulationError
+
+logger = logging.getLogger(__name__)
+
+# fixed point precision used by cv2 to compute the intersections between edges and scanlines
+XY_SHIFT = 16
+# polygons with more vertices are split before being triangulated
+MAX_EAR_CLIPPING_VERTICES = 64
+
+
+def _get_signed_area(vertices):
+    x, y = vertices[:, 0], vertices[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2.0
+
+
+def _cross(a, b, c):
+    return (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+
+
+def _get_vertices(coordinates):
+    vertices = np.asarray(coordinates, dtype=np.float64)[:, :2]
+    # remove the closing point and consecutive duplicated points
+    keep = np.any(vertices != np.roll(vertices, 1, axis=0), axis=1)
+    vertices = vertices[keep]
+    if len(vertices) < 3:
+        raise TriangulationError('a polygon needs at least 3 distinct vertices')
+    if _get_signed_area(vertices) < 0:
+        vertices = vertices[::-1]
+    return vertices
+
+
+def _get_turn(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+# ear clipping triangulation of a simple counterclockwise ring, quadratic in the number of vertices so it is only
+# applied to small polygons; vertices lying inside a candidate ear (or on its border) prevent clipping it, with the
+# exception of the ones overlapping the ear's corners
+def _clip_ears(vertices):
+    points = [tuple(p) for p in vertices.tolist()]
+    indexes = range(len(points))
+    triangles = list()
+    position = 0
+    failures = 0
+    while len(indexes) > 3:
+        position %= len(indexes)
+        a = points[indexes[position - 1]]
+        b = points[indexes[position]]
+        c = points[indexes[(position + 1) % len(indexes)]]
+        turn = _get_turn(a, b, c)
+        if turn == 0:
+            # collinear vertices, remove the middle one without adding an empty triangle
+            del indexes[position]
+            failures = 0
+            continue
+        if turn > 0:
+            for p in (points[i] for i in indexes):
+                if p != a and p != b and p != c and _get_turn(a, b, p) >= 0 and _get_turn(b, c, p) >= 0 and \
+                        _get_turn(c, a, p) >= 0:
+                    break
+            else:
+                triangles.append((a, b, c))
+                del indexes[position]
+                failures = 0
+                continue
+        position += 1
+        failures += 1
+        if failures > len(indexes):
+            raise TriangulationError('unable to find an ear, polygon is not simple')
+    a, b, c = [points[i] for i in indexes]
+    if _get_turn(a, b, c) != 0:
+        triangles.append((a, b, c))
+    return triangles
+
+
+# splits a polygon in two halves along the longest side of its bounding box, clipping by a rectangle is faster than a
+# full overlay but its result is not guaranteed to be valid
+def _split_polygon(polygon, exact=False):
+    x_min, y_min, x_max, y_max = polygon.bounds
+    if x_max - x_min >= y_max - y_min:
+        x_middle = (x_min + x_max) / 2.0
+        halves = ((x_min, y_min, x_middle, y_max), (x_middle, y_min, x_max, y_max))
+    else:
+        y_middle = (y_min + y_max) / 2.0
+        halves = ((x_min, y_min, x_max, y_middle), (x_min, y_middle, x_max, y_max))
+    for half in halves:
+        if exact:
+            pieces = polygon.intersection(box(*half))
+        else:
+            pieces = clip_by_rect(polygon, *half)
+        for piece in getattr(pieces, 'geoms', [pieces]):
+            if isinstance(piece, Polygon) and piece.area > 0:
+                yield piece
+
+
+def _triangulate_pieces(polygon, exact=False):
+    triangles = list()
+    pieces = [polygon]
+    while pieces:
+        piece = pieces.pop()
+        vertices = _get_vertices(piece.exterior.coords)
+        if len(vertices) <= MAX_EAR_CLIPPING_VERTICES:
+            triangles.extend(_clip_ears(vertices))
+        else:
+            pieces.extend(_split_polygon(piece, exact))
+    return np.array(triangles, dtype=np.float64).reshape(-1, 3, 2)
+
+
+# triangulation of a simple polygon, returns a (T, 3, 2) array with the vertices of the triangles. Polygons with more
+# than MAX_EAR_CLIPPING_VERTICES vertices are split in halves by GEOS until the pieces are small enough to be clipped
+# in ears; if the fast rectangle clipping produced pieces that don't add up to the polygon, the split is repeated
+# with exact intersections
+def triangulate_polygon(coordinates):
+    vertices = _get_vertices(coordinates)
+    if len(vertices) <= MAX_EAR_CLIPPING_VERTICES:
+        triangles = np.array(_clip_ears(vertices), dtype=np.float64).reshape(-1, 3, 2)
+    else:
+        polygon = Polygon(vertices)
+        if not polygon.is_valid:
+            raise TriangulationError('polygon is not simple')
+        try:
+            triangles = _triangulate_pieces(polygon)
+        except TriangulationError:
+            triangles = None
+        if triangles is None or not np.isclose(get_triangles_areas(triangles).sum(), polygon.area):
+            triangles = _triangulate_pieces(polygon, exact=True)
+    if not len(triangles):
+        raise TriangulationError('polygon has no area')
+    return triangles
+
+
+def get_triangles_areas(triangles):
+    return np.abs(_cross(triangles[:, 0], triangles[:, 1], triangles[:, 2])) / 2.0
+
+
+# uniform sampling of points_count points in the area covered by the triangles, each point is drawn from a triangle
+# picked with a probability proportional to its area
+def sample_triangles(triangles, points_count, random_state=None, areas=None):
+    random_state = random_state or np.random.RandomState()
+    if areas is None:
+        areas = get_triangles_areas(triangles)
+    cumulative_areas = np.cumsum(areas)
+    picked = np.searchsorted(cumulative_areas, random_state.uniform(0, cumulative_areas[-1], points_count),
+                             side='right')
+    picked = np.minimum(picked, len(triangles) - 1)
+    r1 = random_state.uniform(size=(points_count, 1))
+    r2 = random_state.uniform(size=(points_count, 1))
+    # reflect the points falling in the second half of the parallelogram back into the triangle
+    outside = (r1 + r2) > 1
+    r1[outside] = 1 - r1[outside]
+    r2[outside] = 1 - r2[outside]
+    a, b, c = triangles[picked, 0], triangles[picked, 1], triangles[picked, 2]
+    return a + r1 * (b - a) + r2 * (c - a)
+
+
+# builds a valid polygon from a list of points: duplicated consecutive points are removed and, if the ring crosses
+# or touches itself (self-intersections, zero-area spikes), the polygon is rebuilt from the faces enclosed by the
+# noded ring; if the ring encloses more than one disjoint face (e.g. figure-8 or bow-tie annotations) only the
+# largest polygon is kept, since shapes are handled as a single exterior ring, and the area dropped is logged
+def repair_polygon(coordinates):
+    points = np.array(coordinates, dtype=np.float64)
+    if points.ndim != 2 or len(points) == 0:
+        raise InvalidPolygonError()
+    points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+    if len(points) < 3:
+        raise InvalidPolygonError()
+    polygon = Polygon(points)
+    if polygon.is_valid:
+        return polygon
+    repaired = unary_union(list(polygonize(unary_union(LineString(np.vstack((points, points[:1])))))))
+    if isinstance(repaired, MultiPolygon):
+        faces_count, total_area = len(repaired.geoms), repaired.area
+        repaired = max(repaired.geoms, key=lambda p: p.area)
+        logger.warning('Polygon ring encloses %d disjoint faces, only the largest one is kept: '
+                       '%.1f of %.1f square pixels (%.1f%%) are dropped', faces_count,
+                       total_area - repaired.area, total_area, 100 * (total_area - repaired.area) / total_area)
+    if not isinstance(repaired, Polygon) or repaired.is_empty or repaired.area == 0:
+        raise InvalidPolygonError()
+    return Polygon(repaired.exterior)
+
+
+# intersections between the edges of the polygon and the rows in [y_min, y_max) as computed by cv2.fillPoly, returned
+# as (rows, x_min, x_max) pixels of the spans filled on each row
+def _get_fill_spans(polygon_path, y_min, y_max):
+    points = polygon_path.astype(np.int64)
+    previous_points = np.roll(points, 1, axis=0)
+    edges = points[:, 1] != previous_points[:, 1]
+    points, previous_points = points[edges], previous_points[edges]
+    upper_points = np.where((points[:, 1] < previous_points[:, 1])[:, None], points, previous_points)
+    lower_points = np.where((points[:, 1] < previous_points[:, 1])[:, None], previous_points, points)
+    # cv2 divides the fixed point slopes rounding towards zero
+    x_steps = (lower_points[:, 0] - upper_points[:, 0]) << XY_SHIFT
+    y_steps = lower_points[:, 1] - upper_points[:, 1]
+    slopes = np.sign(x_steps) * (np.abs(x_steps) // y_steps)
+    rows_start = np.maximum(upper_points[:, 1], y_min)
+    rows_count = np.maximum(np.minimum(lower_points[:, 1], y_max) - rows_start, 0)
+    edges = np.repeat(np.arange(len(rows_count)), rows_count)
+    rows = np.arange(rows_count.sum()) - np.repeat(np.cumsum(rows_count) - rows_count, rows_count) + \
+        rows_start[edges]
+    xs = (upper_points[edges, 0] << XY_SHIFT) + (rows - upper_points[edges, 1]) * slopes[edges]
+    order = np.lexsort((xs, rows))
+    rows, xs = rows[order], xs[order]
+    # each row crosses an even number of edges, consecutive crossings delimit the filled spans
+    return rows[::2], (xs[::2] + (1 << XY_SHIFT) - 1) >> XY_SHIFT, xs[1::2] >> XY_SHIFT
+
+
+# pixels in the rows in [y_min, y_max) of the 8-connected line drawn by cv2 between two points inside the image
+def _get_line_pixels(start, end, y_min, y_max):
+    (x0, y0), (x1, y1) = start, end
+    if x1 < x0:
+        x0, y0, x1, y1 = x1, y1, x0, y0
+    dx, dy = x1 - x0, abs(y1 - y0)
+    y_step = -1 if y1 < y0 else 1
+    if dy > dx:
+        # one pixel for each row, the column moves right by one every time the error term becomes negative
+        if y_step > 0:
+            steps = np.arange(max(y_min - y0, 0), min(y_max - y0, dy + 1))
+        else:
+            steps = np.arange(max(y0 - y_max + 1, 0), min(y0 - y_min + 1, dy + 1))
+        return y0 + y_step * steps, x0 - ((dy - 2 * dx * steps) // (2 * dy))
+    if dy == 0:
+        if not y_min <= y0 < y_max:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        steps = np.arange(dx + 1)
+        return np.full(len(steps), y0, dtype=np.int64), x0 + steps
+    # one pixel for each column, only the columns that can reach the rows of the stripe are computed
+    if y_step > 0:
+        rows_start, rows_end = y_min - y0, y_max - 1 - y0
+    else:
+        rows_start, rows_end = y0 - y_max + 1, y0 - y_min
+    steps_start = max((2 * dx * (rows_start - 1) + dx) // (2 * dy) + 1, 0)
+    steps_end = min((2 * dx * rows_end + dx) // (2 * dy), dx)
+    steps = np.arange(steps_start, steps_end + 1)
+    rows = y0 + y_step * -((dx - 2 * dy * steps) // (2 * dx))
+    inside = (rows >= y_min) & (rows < y_max)
+    return rows[inside], x0 + steps[inside]
+
+
+# draws the rows of the mask of an image with mask_height rows starting from y_offset into stripe, the result is the
+# same of cv2.fillPoly applied to the whole image: cv2 clips the outline to the image before drawing it, so filling
+# the stripe alone with cv2 would move the pixels of the slanted edges that cross its borders
+def fill_polygon_stripe(stripe, polygon_path, y_offset, mask_height, value=1):
+    stripe_height, stripe_width = stripe.shape[:2]
+    y_max = y_offset + stripe_height
+    rows, spans_start, spans_end = _get_fill_spans(polygon_path, y_offset, y_max)
+    spans_start, spans_end = np.maximum(spans_start, 0), np.minimum(spans_end, stripe_width - 1)
+    for row, span_start, span_end in zip(rows - y_offset, spans_start, spans_end):
+        if span_start <= span_end:
+            stripe[row, span_start:span_end + 1] = value
+    image_rect = (0, 0, stripe_width, mask_height)
+    starts = np.roll(polygon_path, 1, axis=0)
+    crossing_edges = (np.maximum(starts[:, 1], polygon_path[:, 1]) >= y_offset) & \
+        (np.minimum(starts[:, 1], polygon_path[:, 1]) < y_max)
+    for start, end in zip(starts[crossing_edges].tolist(), polygon_path[crossing_edges].tolist()):
+        if not (0 <= start[0] < stripe_width and 0 <= end[0] < stripe_width and
+                0 <= start[1] < mask_height and 0 <= end[1] < mask_height):
+            inside, start, end = cv2.clipLine(image_rect, tuple(start), tuple(end))
+            if not inside:
+                continue
+        line_rows, line_columns = _get_line_pixels(start, end, y_offset, y_max)
+        stripe[line_rows - y_offset, line_columns] = value
+    return stripe
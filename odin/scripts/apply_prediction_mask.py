@@ -18,7 +18,6 @@
 #  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import os, sys, argparse, logging, cv2
-import numpy as np
 from PIL import Image
 
 # TODO: install.py for odin lib and remove this abomination
@@ -80,7 +79,7 @@ class PredictionMaskApplier(object):
         return Image.fromarray(patch_img)
 
     def _load_mask(self, mask_path, mask_label):
-        return np.load(mask_path)[mask_label]
+        return mask_utils.load_masks(mask_path)[mask_label]
 
     def _apply_mask(self, patch_img, mask, color, alpha):
         patch_img = apply_mask(patch_img, mask, color, alpha)
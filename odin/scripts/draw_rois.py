@@ -27,6 +27,7 @@ sys.path.append('../../')
 
 from odin.libs.promort.client import ProMortClient
 from odin.libs.regions_of_interest.shapes_manager import Shape
+from odin.libs.regions_of_interest.errors import InvalidPolygonError
 
 LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
@@ -93,7 +94,11 @@ class ROIsApplier(object):
 
     def _get_scaled_shape(self, roi_json, scale_factor):
         self.logger.debug('Rescaling ROI')
-        shape = Shape(roi_json)
+        try:
+            shape = Shape(roi_json)
+        except InvalidPolygonError, e:
+            self.logger.warning('Skipping invalid ROI: %s', e)
+            return None
         scaled_shape = shape._rescale_polygon(scale_factor)
         return mapping(scaled_shape)['coordinates']
 
@@ -104,6 +109,8 @@ class ROIsApplier(object):
 
     def _draw_roi(self, image, roi_json, zoom_level, line_color, line_width=5):
         scaled_roi = self._get_scaled_shape(roi_json[0], zoom_level)
+        if scaled_roi is None:
+            return
         image.line(list(scaled_roi[0]), fill=line_color, width=line_width)
 
     def _apply_rois(self, original_slide, slices, cores, focus_regions, zoom_level, slide_label, output_path):
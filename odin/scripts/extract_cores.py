@@ -29,6 +29,8 @@ except ImportError:
 sys.path.append('../../')
 
 from odin.libs.regions_of_interest.shapes_manager import Shape
+from odin.libs.regions_of_interest.shapes_collection import ShapeCollection
+from odin.libs.regions_of_interest.errors import InvalidPolygonError
 
 LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
@@ -77,7 +79,7 @@ class AutomaticCoresExtractor(object):
             normalize_contour.append(tuple(x[0]))
         try:
             return Shape(normalize_contour)
-        except ValueError:
+        except (ValueError, InvalidPolygonError):
             return None
 
     def _get_cores(self, tissue_mask):
@@ -86,11 +88,8 @@ class AutomaticCoresExtractor(object):
         return contours
 
     def _filter_cores(self, cores, slide_area, core_min_area=0.02):
-        accepted_cores = list()
-        for core in cores:
-            if (core.get_area()*100 / slide_area) >= core_min_area:
-                accepted_cores.append(core)
-        return accepted_cores
+        areas = ShapeCollection.from_shapes(cores).get_areas()
+        return [core for core, area in zip(cores, areas) if (area*100 / slide_area) >= core_min_area]
 
     def _get_scale_factor(self, slide_resolution, mask_resolution):
         scale_factor = sqrt((slide_resolution[0]*slide_resolution[1]) / (mask_resolution[0]*mask_resolution[1]))
@@ -121,10 +120,9 @@ class AutomaticCoresExtractor(object):
         return cores_groups
 
     def _get_slice(self, cores_group):
-        x_min = min([c.get_bounds()['x_min'] for c in cores_group])
-        y_min = min([c.get_bounds()['y_min'] for c in cores_group])
-        x_max = max([c.get_bounds()['x_max'] for c in cores_group])
-        y_max = max([c.get_bounds()['y_max'] for c in cores_group])
+        bounds = ShapeCollection.from_shapes(cores_group).get_bounds()
+        x_min, y_min = bounds[:, :2].min(axis=0)
+        x_max, y_max = bounds[:, 2:].max(axis=0)
         return Shape([(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)])
 
     def _build_slide_json(self, cores_group, scale_factor):
@@ -58,32 +58,26 @@ class MasksToSlideApplier(object):
         logger.addHandler(handler)
         return logger
 
-    def _create_slide_image(self, slide_file, zoom_level, tile_size=256):
+    def _create_slide_image(self, slide_file, zoom_level, tile_size=256, cache_folder=None):
         try:
             dzi_wrapper = DeepZoomWrapper(slide_file, tile_size)
         except UnsupportedFormatError:
             sys.exit('File type not supported')
         target_level = dzi_wrapper.get_max_zoom_level() + zoom_level
         img_resolution = dzi_wrapper.get_level_resolution(target_level)
+        if cache_folder:
+            self.logger.info('Loading level %d from cache folder %s', target_level, cache_folder)
+            level_array = dzi_wrapper.materialize_level(target_level, cache_folder)
+            return Image.fromarray(np.array(level_array)), img_resolution
         full_slide_img = Image.new('RGB', (img_resolution['width'], img_resolution['height']))
-        tiles_resolution = dzi_wrapper.get_level_grid(target_level)
-        for row in xrange(0, tiles_resolution['rows']):
-            for col in xrange(0, tiles_resolution['columns']):
-                tile = dzi_wrapper.get_tile(target_level, col, row)
-                full_slide_img.paste(tile, ((col * tile_size), (row * tile_size)))
+        for (col, row), tile in dzi_wrapper.iter_tiles(target_level):
+            full_slide_img.paste(tile, ((col * tile_size), (row * tile_size)))
         return full_slide_img, img_resolution
 
+    # mask_origin is expressed as (row, column), slide_resolution as (width, height)
     def _reshape_mask(self, mask, mask_origin, slide_resolution):
-        upper_right = mask_origin[1] + mask.shape[0]
-        lower_left = mask_origin[0] + mask.shape[1]
-        if upper_right > slide_resolution[0]:
-            max_x = upper_right - slide_resolution[0]
-        else:
-            max_x = mask.shape[0]
-        if lower_left > slide_resolution[1]:
-            max_y = lower_left - slide_resolution[1]
-        else:
-            max_y = mask.shape[1]
+        max_x = min(mask.shape[0], slide_resolution[1] - mask_origin[0])
+        max_y = min(mask.shape[1], slide_resolution[0] - mask_origin[1])
         return mask[0:max_x, 0:max_y]
 
     def _create_full_mask(self, slide_resolution, masks_folder):
@@ -101,14 +95,15 @@ class MasksToSlideApplier(object):
         return full_mask
 
     def run(self, slide_label, zoom_level, slides_folder, masks_folder, out_folder, contours_color,
-            contours_thickness):
+            contours_thickness, cache_folder=None):
         self.logger.info('Starting job')
         slide_file = os.path.join(slides_folder, '%s.mrxs' % slide_label)
         masks_folder = os.path.join(masks_folder, slide_label)
         if os.path.isfile(slide_file) and os.path.isdir(masks_folder):
             # TODO: add tile_size to arguments
             self.logger.info('Reconstructing slide %s for zoom level %d', slide_label, zoom_level)
-            slide_img, slide_resolution = self._create_slide_image(slide_file, zoom_level)
+            slide_img, slide_resolution = self._create_slide_image(slide_file, zoom_level,
+                                                                   cache_folder=cache_folder)
             self.logger.info('Reconstruction completed')
             self.logger.info('Building full prediction mask')
             full_mask = self._create_full_mask(slide_resolution, masks_folder)
@@ -135,6 +130,8 @@ def get_parser():
     parser.add_argument('--output-folder', type=str, required=True, help='')
     parser.add_argument('--contours-color', nargs='+', type=int, default=[0, 0, 255], help='')
     parser.add_argument('--contours-thickness', type=int, default=2, help='')
+    parser.add_argument('--cache-folder', type=str, default=None,
+                        help='folder used to cache the slide level as a memory-mapped array (default=no cache)')
     parser.add_argument('--log-level', type=str, default='INFO', help='log level (default=INFO)')
     parser.add_argument('--log-file', type=str, default=None, help='log file (default=stderr)')
     return parser
@@ -145,7 +142,7 @@ def main(argv):
     args = parser.parse_args(argv)
     masks_applier = MasksToSlideApplier(args.log_level, args.log_file)
     masks_applier.run(args.slide_label, args.zoom_level, args.slides_folder, args.masks_folder,
-                      args.output_folder, args.contours_color, args.contours_thickness)
+                      args.output_folder, args.contours_color, args.contours_thickness, args.cache_folder)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,314 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os, sys, argparse, logging, resource, shutil, tempfile
+import numpy as np
+import cv2
+from time import time
+from multiprocessing import Process, Queue
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# TODO: install.py for odin lib and remove this abomination
+sys.path.append('../../')
+
+from odin.libs.deepzoom.deepzoom_wrapper import DeepZoomWrapper
+from odin.libs.deepzoom.tiles_cache import TilesCache
+from odin.libs.patches.patches_extractor import PatchesExtractor
+from slide_to_tiles import TilesExtractor
+from masks_to_slide import MasksToSlideApplier
+
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+
+def get_peak_rss():
+    # ru_maxrss is expressed in KB, children are included to account for the workers spawned by the scripts
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.
+
+
+def run_benchmark(benchmark, results_queue, *args):
+    try:
+        results = benchmark(*args)
+        results['peak_rss_mb'] = get_peak_rss()
+        results_queue.put(results)
+    except Exception, e:
+        results_queue.put({'error': repr(e)})
+
+
+class SlideIOBenchmark(object):
+
+    def __init__(self, log_level='INFO', log_file=None):
+        self.logger = self._get_logger(log_level, log_file)
+
+    def _get_logger(self, log_level='INFO', log_file=None, mode='a'):
+        LOG_FORMAT = '%(asctime)s|%(levelname)-8s|%(message)s'
+        LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+        logger = logging.getLogger('slide_io_benchmark')
+        if not isinstance(log_level, int):
+            try:
+                log_level = getattr(logging, log_level)
+            except AttributeError:
+                raise ValueError('Unsupported literal log level: %s' % log_level)
+        logger.setLevel(log_level)
+        logger.handlers = []
+        if log_file:
+            handler = logging.FileHandler(log_file, mode=mode)
+        else:
+            handler = logging.StreamHandler()
+        formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        return logger
+
+    def _build_slide_image(self, width, height, seed):
+        # white background with random tissue-like blobs, no real data is used
+        random_state = np.random.RandomState(seed)
+        slide_img = np.full((height, width, 3), 255, dtype=np.uint8)
+        min_radius = max(min(width, height) / 100, 1)
+        max_radius = max(min(width, height) / 8, min_radius + 1)
+        for _ in xrange(max((width * height) / (max_radius * max_radius), 1)):
+            center = (random_state.randint(0, width), random_state.randint(0, height))
+            color = tuple(int(c) for c in random_state.randint(90, 220, 3))
+            cv2.circle(slide_img, center, random_state.randint(min_radius, max_radius), color, -1)
+        noise = random_state.randint(0, 16, (height, width, 1)).astype(np.uint8)
+        tissue = slide_img.min(axis=-1) < 230
+        slide_img[tissue] -= noise[tissue]
+        return slide_img
+
+    def _build_synthetic_slide(self, slide_path, width, height, tile_size, seed):
+        if tifffile is None:
+            sys.exit('tifffile is required to build synthetic slides')
+        slide_img = self._build_slide_image(width, height, seed)
+        with tifffile.TiffWriter(slide_path, bigtiff=True) as tiff_writer:
+            level_img = slide_img
+            subfile_type = 0
+            while True:
+                tiff_writer.save(level_img, tile=(tile_size, tile_size), photometric='rgb', compress=6,
+                                 subfiletype=subfile_type)
+                if min(level_img.shape[:2]) < 2 * tile_size:
+                    break
+                level_img = cv2.resize(level_img, (level_img.shape[1] / 2, level_img.shape[0] / 2),
+                                       interpolation=cv2.INTER_AREA)
+                subfile_type = 1
+
+    def _build_prediction_masks(self, slide_path, masks_folder, zoom_level, tile_size, seed):
+        random_state = np.random.RandomState(seed)
+        dzi_wrapper = DeepZoomWrapper(slide_path, tile_size)
+        target_level = dzi_wrapper.get_max_zoom_level() + zoom_level
+        grid = dzi_wrapper.get_level_grid(target_level)
+        for row in xrange(grid['rows']):
+            for col in xrange(grid['columns']):
+                prediction = np.uint8(random_state.rand(tile_size, tile_size) > 0.5)
+                np.savez(os.path.join(masks_folder, 'synthetic_L%d_%d_%d.npz' % (target_level, row, col)),
+                         prediction=prediction)
+
+    @staticmethod
+    def _summarize(latencies, items_count, elapsed_time):
+        results = {
+            'items': items_count,
+            'elapsed_s': elapsed_time,
+            'items_per_second': items_count / elapsed_time if elapsed_time > 0 else None
+        }
+        if latencies:
+            results['latency_p50_ms'] = float(np.percentile(latencies, 50)) * 1000
+            results['latency_p99_ms'] = float(np.percentile(latencies, 99)) * 1000
+        return results
+
+    @staticmethod
+    def _get_level_tiles(dzi_wrapper, level):
+        grid = dzi_wrapper.get_level_grid(level)
+        return [(col, row) for row in xrange(grid['rows']) for col in xrange(grid['columns'])]
+
+    @staticmethod
+    def _benchmark_get_tile(slide_path, tile_size, zoom_level, tile_format):
+        dzi_wrapper = DeepZoomWrapper(slide_path, tile_size, tiles_cache=TilesCache(0))
+        level = dzi_wrapper.get_max_zoom_level() + zoom_level
+        latencies = list()
+        start_time = time()
+        for col, row in SlideIOBenchmark._get_level_tiles(dzi_wrapper, level):
+            tile_start_time = time()
+            dzi_wrapper.get_tile(level, col, row, format=tile_format)
+            latencies.append(time() - tile_start_time)
+        return SlideIOBenchmark._summarize(latencies, len(latencies), time() - start_time)
+
+    @staticmethod
+    def _benchmark_get_tiles(slide_path, tile_size, zoom_level):
+        dzi_wrapper = DeepZoomWrapper(slide_path, tile_size, tiles_cache=TilesCache(0))
+        level = dzi_wrapper.get_max_zoom_level() + zoom_level
+        grid = dzi_wrapper.get_level_grid(level)
+        latencies = list()
+        start_time = time()
+        for row in xrange(grid['rows']):
+            row_start_time = time()
+            dzi_wrapper.get_tiles(level, [(col, row) for col in xrange(grid['columns'])])
+            latencies.append(time() - row_start_time)
+        results = SlideIOBenchmark._summarize(latencies, grid['rows'] * grid['columns'], time() - start_time)
+        results['latency_unit'] = 'row'
+        return results
+
+    @staticmethod
+    def _benchmark_iter_tiles(slide_path, tile_size, zoom_level, workers):
+        dzi_wrapper = DeepZoomWrapper(slide_path, tile_size, tiles_cache=TilesCache(0))
+        level = dzi_wrapper.get_max_zoom_level() + zoom_level
+        latencies = list()
+        start_time = time()
+        tile_start_time = start_time
+        for _ in dzi_wrapper.iter_tiles(level, workers=workers, prefetch=4 * workers):
+            latencies.append(time() - tile_start_time)
+            tile_start_time = time()
+        return SlideIOBenchmark._summarize(latencies, len(latencies), time() - start_time)
+
+    @staticmethod
+    def _benchmark_get_patch(slide_path, tile_size, zoom_level, patches_count, seed):
+        dzi_wrapper = DeepZoomWrapper(slide_path, tile_size)
+        patches_extractor = PatchesExtractor(dzi_wrapper)
+        resolution = dzi_wrapper.get_slide_original_resolution()
+        random_state = np.random.RandomState(seed)
+        centers = random_state.rand(patches_count, 2) * [resolution['width'], resolution['height']]
+        latencies = list()
+        start_time = time()
+        for center in centers:
+            patch_start_time = time()
+            patches_extractor.get_patch(center, zoom_level)
+            latencies.append(time() - patch_start_time)
+        return SlideIOBenchmark._summarize(latencies, len(latencies), time() - start_time)
+
+    @staticmethod
+    def _benchmark_slide_to_tiles(slide_path, tile_size, zoom_level, workers, out_folder):
+        tiles_extractor = TilesExtractor(slide_path, tile_size, log_level='WARNING')
+        level = tiles_extractor.dzi_wrapper.get_max_zoom_level() + zoom_level
+        tiles_count = len(SlideIOBenchmark._get_level_tiles(tiles_extractor.dzi_wrapper, level))
+        start_time = time()
+        tiles_extractor.run(zoom_level, 100, out_folder, workers)
+        return SlideIOBenchmark._summarize(None, tiles_count, time() - start_time)
+
+    @staticmethod
+    def _benchmark_masks_to_slide(slide_path, tile_size, zoom_level, masks_folder):
+        masks_applier = MasksToSlideApplier(log_level='WARNING')
+        start_time = time()
+        _, slide_resolution = masks_applier._create_slide_image(slide_path, zoom_level, tile_size)
+        masks_applier._create_full_mask(slide_resolution, masks_folder)
+        return SlideIOBenchmark._summarize(None, len(os.listdir(masks_folder)), time() - start_time)
+
+    def _run_benchmark(self, label, benchmark, *args):
+        self.logger.info('Running benchmark %s', label)
+        # each benchmark runs in its own process, this way cold caches and peak RSS are not shared among them
+        results_queue = Queue()
+        benchmark_process = Process(target=run_benchmark, args=(benchmark, results_queue) + args)
+        benchmark_process.start()
+        results = results_queue.get()
+        benchmark_process.join()
+        if 'error' in results:
+            self.logger.error('Benchmark %s failed: %s', label, results['error'])
+        else:
+            # items_per_second is None when the benchmark ran too fast for the timer
+            if results['items_per_second'] is None:
+                items_per_second = 'n/a'
+            else:
+                items_per_second = '%.2f' % results['items_per_second']
+            self.logger.info('%s --- %s items/s, p50 %s ms, p99 %s ms, peak RSS %.1f MB', label,
+                             items_per_second, results.get('latency_p50_ms'),
+                             results.get('latency_p99_ms'), results['peak_rss_mb'])
+        return results
+
+    def run(self, width, height, tile_size, zoom_level, patches_count, workers, seed, work_folder, output_file):
+        keep_work_folder = work_folder is not None
+        work_folder = work_folder or tempfile.mkdtemp(prefix='odin_benchmark_')
+        slide_path = os.path.join(work_folder, 'synthetic.tiff')
+        tiles_folder = os.path.join(work_folder, 'tiles')
+        masks_folder = os.path.join(work_folder, 'masks')
+        for folder in (tiles_folder, masks_folder):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        try:
+            self.logger.info('Building a %dx%d synthetic slide', width, height)
+            self._build_synthetic_slide(slide_path, width, height, tile_size, seed)
+            self._build_prediction_masks(slide_path, masks_folder, zoom_level, tile_size, seed)
+            benchmarks = [
+                ('get_tile_raw', self._benchmark_get_tile, slide_path, tile_size, zoom_level, None),
+                ('get_tile_jpeg', self._benchmark_get_tile, slide_path, tile_size, zoom_level, 'jpeg'),
+                ('get_tiles', self._benchmark_get_tiles, slide_path, tile_size, zoom_level),
+                ('iter_tiles', self._benchmark_iter_tiles, slide_path, tile_size, zoom_level, workers),
+                ('get_patch', self._benchmark_get_patch, slide_path, tile_size, zoom_level, patches_count, seed),
+                ('slide_to_tiles', self._benchmark_slide_to_tiles, slide_path, tile_size, zoom_level, workers,
+                 tiles_folder),
+                ('masks_to_slide', self._benchmark_masks_to_slide, slide_path, tile_size, zoom_level, masks_folder)
+            ]
+            report = {
+                'slide': {
+                    'width': width,
+                    'height': height,
+                    'tile_size': tile_size,
+                    'zoom_level': zoom_level,
+                    'seed': seed
+                },
+                'workers': workers,
+                'benchmarks': dict()
+            }
+            for b in benchmarks:
+                report['benchmarks'][b[0]] = self._run_benchmark(*b)
+        finally:
+            if not keep_work_folder:
+                shutil.rmtree(work_folder)
+        if output_file:
+            with open(output_file, 'w') as ofile:
+                ofile.write(json.dumps(report, indent=2, sort_keys=True))
+            self.logger.info('Results saved to file %s', output_file)
+        else:
+            print json.dumps(report, indent=2, sort_keys=True)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=8192, help='width of the synthetic slide (default=8192)')
+    parser.add_argument('--height', type=int, default=8192, help='height of the synthetic slide (default=8192)')
+    parser.add_argument('--tile-size', type=int, default=256, help='tile size in pixels (default=256)')
+    parser.add_argument('--zoom-level', type=int, default=0,
+                        help='zoom level used by the benchmarks (as a negative number where 0 is the slide\'s full resolution level)')
+    parser.add_argument('--patches-count', type=int, default=1000,
+                        help='number of random patches read by the get_patch benchmark (default=1000)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='threads or processes used by the parallel benchmarks (default=4)')
+    parser.add_argument('--seed', type=int, default=0, help='seed used to build the synthetic data (default=0)')
+    parser.add_argument('--work-folder', type=str, default=None,
+                        help='folder for the synthetic slide and the outputs, if not specified a temporary folder is used and removed at the end of the job')
+    parser.add_argument('--output-file', type=str, default=None, help='output JSON file (default=stdout)')
+    parser.add_argument('--log-level', type=str, default='INFO', help='log level (default=INFO)')
+    parser.add_argument('--log-file', type=str, default=None, help='log file (default=stderr)')
+    return parser
+
+
+def main(argv):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    benchmark = SlideIOBenchmark(args.log_level, args.log_file)
+    benchmark.run(args.width, args.height, args.tile_size, args.zoom_level, args.patches_count, args.workers,
+                  args.seed, args.work_folder, args.output_file)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -27,13 +27,13 @@ sys.path.append('../../')
 
 from odin.libs.deepzoom.deepzoom_wrapper import DeepZoomWrapper
 from odin.libs.deepzoom.errors import UnsupportedFormatError, MissingFileError
-from odin.libs.patches.utils import extract_white_mask
+from odin.libs.patches.utils import get_white_percentages
 
 LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
 
-def extract_row_tiles(dzi_wrapper, slide_label, tile_size, row, col, zoom_level, max_white, out_folder):
-    return TilesExtractor.process_row(dzi_wrapper, slide_label, tile_size, row, col, zoom_level, max_white,
+def extract_row_tiles(dzi_wrapper, slide_label, tile_size, row, columns, zoom_level, max_white, out_folder):
+    return TilesExtractor.process_row(dzi_wrapper, slide_label, tile_size, row, columns, zoom_level, max_white,
                                       out_folder)
 
 
@@ -79,38 +79,20 @@ class TilesExtractor(object):
     @staticmethod
     def process_row(slide_path, slide_label, tile_size, row, columns, zoom_level, max_white_percentage,
                     out_folder):
+        # columns is the list of the columns of the row that must be read
         dzi_wrapper = DeepZoomWrapper(slide_path, tile_size)
-        for col in xrange(0, columns):
-            tile = TilesExtractor._get_tile(dzi_wrapper, tile_size,
-                                            zoom_level, col, row, max_white_percentage)
-            if tile:
-                tfname = TilesExtractor._get_tile_fname(slide_label, zoom_level, col, row)
-                TilesExtractor._save_tile(tile, tfname, out_folder)
-        return row
-
-    @staticmethod
-    def _get_tile(dzi_wrapper, tile_size, zoom_level, column, row, max_white_percentage):
-        tile = dzi_wrapper.get_tile(zoom_level, column, row)
-        tile = TilesExtractor._complete_tile(tile, tile_size)
+        tiles = dzi_wrapper.get_tiles(zoom_level, [(col, row) for col in columns])
         if max_white_percentage == 100:
-            return tile
+            accepted_tiles = np.ones(len(columns), dtype=np.bool)
         else:
-            if TilesExtractor._accept_tile(tile, max_white_percentage):
-                return tile
-            else:
-                return None
-
-    @staticmethod
-    def _complete_tile(tile, tile_size):
-        white_img = Image.new('RGB', (tile_size, tile_size), (255, 255, 255))
-        white_img.paste(tile, (0, 0))
-        return white_img
-
-    @staticmethod
-    def _accept_tile(tile, max_white_percentage):
-        white_mask = extract_white_mask(tile, 230)
-        white_percentage = white_mask.sum() / np.prod(white_mask.shape)
-        return white_percentage <= max_white_percentage
+            # the white percentage has always been computed with an integer division, so only
+            # completely white tiles reach 1 while all the other ones count as 0
+            white_percentages = np.floor(get_white_percentages(tiles, 230))
+            accepted_tiles = white_percentages <= max_white_percentage
+        for i in np.flatnonzero(accepted_tiles):
+            tfname = TilesExtractor._get_tile_fname(slide_label, zoom_level, columns[i], row)
+            TilesExtractor._save_tile(Image.fromarray(tiles[i]), tfname, out_folder)
+        return row
 
     @staticmethod
     def _get_tile_fname(slide_label, zoom_level, column, row):
@@ -136,14 +118,24 @@ class TilesExtractor(object):
         finally:
             out_folder = os.path.join(out_folder, self.slide_label)
             self.logger.debug('Saving tile into folder %s', out_folder)
+        if max_white_percentage == 100:
+            tissue_index = np.ones((tiles_resolution['rows'], tiles_resolution['columns']), dtype=np.bool)
+        else:
+            # tiles that are completely white in the tissue index are skipped without reading them, process_row still
+            # checks the white percentage of all the other ones
+            tissue_index = self.dzi_wrapper.get_tissue_index(target_level, 230)
+            self.logger.info('%d of %d tiles contain tissue', tissue_index.sum(), tissue_index.size)
         runners_pool = Pool(processes=max_processes)
         results = [runners_pool.apply_async(extract_row_tiles, (self.slide_path, self.slide_label, self.tile_size, row,
-                                                                tiles_resolution['columns'], target_level,
+                                                                list(np.flatnonzero(tissue_index[row])), target_level,
                                                                 max_white_percentage,
                                                                 out_folder)) for row in
                    xrange(0, tiles_resolution['rows'])]
         for p in results:
             self.logger.debug('Row %d processed' % p.get())
+        # workers are reaped here, otherwise their resources usage is not accounted to this process
+        runners_pool.close()
+        runners_pool.join()
         self.logger.info('Job completed')
 
 
@@ -19,20 +19,27 @@
 
 from csv import DictReader, DictWriter
 import os
-from itertools import chain
-from uuid import uuid4
+from itertools import chain, izip
+from hashlib import sha1
 import numpy as np
-from shapely.errors import TopologicalError
+from PIL import Image
 
 from odin.libs.promort.client import ProMortClient
 from odin.libs.promort.errors import ProMortAuthenticationError, UserNotAllowed
-from odin.libs.regions_of_interest.shapes_manager import ShapesManager
+from odin.libs.regions_of_interest.shapes_manager import ShapesManager, ShapesIndex
 from odin.libs.regions_of_interest.errors import InvalidPolygonError
 from odin.libs.deepzoom.deepzoom_wrapper import DeepZoomWrapper
-from odin.libs.deepzoom.errors import DZIBadTileAddress
+from odin.libs.deepzoom.tiles_cache import TilesCache
 from odin.libs.patches.patches_extractor import PatchesExtractor
+from odin.libs.patches.dataset_writer import PatchesDatasetWriter
+from odin.libs.patches.extraction_journal import ExtractionJournal
 from odin.libs.patches.utils import extract_white_mask
 from odin.libs.masks_manager import utils as mmu
+from odin.libs.masks_manager.labels_raster import LabelsRaster
+from odin.libs.masks_manager.masks_builder import PatchMasksBuilder
+
+PATCHES_MAP_FIELDS = ['slide_id', 'focus_region_id', 'patch_uuid', 'x', 'y', 'tissue_fraction',
+                      'tumor_fraction', 'not_tumor_fraction']
 
 
 class RandomPatchesExtractor(object):
@@ -57,139 +64,284 @@ class RandomPatchesExtractor(object):
                     negative_focus_regions.add(row['focus_region_id'])
         return dependencies_tree, positive_focus_regions, negative_focus_regions
 
+    # returns the shapes of the focus regions grouped by label and the status of the regions that are skipped
     def _load_focus_regions(self, focus_regions, slide_id, positive_regions, negative_regions):
         fregions = {
             'positive': [],
             'negative': []
         }
+        skipped_regions = dict()
         for region in focus_regions:
             if region in positive_regions:
-                fregions['positive'].append((self.shapes_manager.get_focus_region(slide_id, region), region))
+                label = 'positive'
             elif region in negative_regions:
-                fregions['negative'].append((self.shapes_manager.get_focus_region(slide_id, region), region))
+                label = 'negative'
             else:
                 self.logger.critical('There is no classification for focus region %r of slide %s', region, slide_id)
-        return fregions
-
-    def _extract_patch(self, point, scaling, extractor):
-        return extractor.get_patch((point.x, point.y), scaling)
-
-    def _get_tissue_masks(self, patch_coordinates, core, scaling, tolerance):
-        tissue_mask = core.get_intersection_mask(patch_coordinates, scaling, tolerance)
-        not_tissue_mask = core.get_difference_mask(patch_coordinates, scaling, tolerance)
-        return tissue_mask, not_tissue_mask
-
-    def _get_regions_mask(self, patch_coordinates, regions, tile_size, scaling, tolerance):
-        mask = np.zeros((tile_size, tile_size), np.uint8)
-        for r in regions:
-            m = r[0].get_intersection_mask(patch_coordinates, scaling, tolerance)
-            mask = mmu.add_mask(mask, m)
-        return mask
-
-    def _get_positive_regions_mask(self, patch_coordinates, positive_regions, tile_size, scaling, tolerance):
-        return self._get_regions_mask(patch_coordinates, positive_regions, tile_size, scaling, tolerance)
-
-    def _get_negative_regions_mask(self, patch_coordinates, negative_regions, tile_size, scaling, tolerance):
-        return self._get_regions_mask(patch_coordinates, negative_regions, tile_size, scaling, tolerance)
-
-    def _build_masks(self, patch_coordinates, core, positive_regions, negative_regions, patch_image, tile_size,
-                     scaling, tolerance, white_lower_bound):
-        tissue_mask, not_tissue_mask = self._get_tissue_masks(patch_coordinates, core,
-                                                              scaling, tolerance)
-        return {
-            'tissue': tissue_mask,
-            'not_tissue': not_tissue_mask,
-            'tumor': self._get_positive_regions_mask(patch_coordinates, positive_regions,
-                                                     tile_size, scaling, tolerance),
-            'not_tumor': self._get_negative_regions_mask(patch_coordinates, negative_regions,
-                                                         tile_size, scaling, tolerance),
-            'cv2_white': extract_white_mask(patch_image, white_lower_bound)
-        }
+                skipped_regions[region] = 'unclassified'
+                continue
+            try:
+                fregions[label].append((self.shapes_manager.get_focus_region(slide_id, region), region))
+            except InvalidPolygonError:
+                self.logger.error('FocusRegion %r of slide %s is not a valid shape, skipping it', region, slide_id)
+                skipped_regions[region] = 'invalid_shape'
+        return fregions, skipped_regions
+
+    def _extract_patches(self, points, scaling, extractor):
+        return extractor.get_patches([(p.x, p.y) for p in points], scaling)
+
+    # patches sharing the center of a patch at each one of the context scales, as a (S, P, P, 3) array
+    def _extract_context_patches(self, point, context_scales, extractor):
+        return extractor.get_patch_pyramid((point.x, point.y), context_scales)[0]
+
+    # masks_builder is either a LabelsRaster or a PatchMasksBuilder, see _get_masks_builder
+    def _build_masks(self, patch_coordinates, masks_builder, patch_image, white_lower_bound):
+        masks = masks_builder.get_masks(patch_coordinates)
+        masks['cv2_white'] = extract_white_mask(patch_image, white_lower_bound)
+        return masks
+
+    # in raster mode the core and its focus regions are rasterised once and the masks of the patches are slices of
+    # the raster (big rasters are memory mapped to temporary files in cache_folder), in shapes mode masks are built
+    # intersecting the shapes with each patch
+    def _get_masks_builder(self, masks_mode, core, focus_regions_shapes, tile_size, scaling, cache_folder=None):
+        positive_regions = [r[0] for r in focus_regions_shapes['positive']]
+        negative_regions = [r[0] for r in focus_regions_shapes['negative']]
+        if masks_mode == 'raster':
+            return LabelsRaster(core, positive_regions, negative_regions, tile_size, scaling, cache_folder)
+        else:
+            return PatchMasksBuilder(core, positive_regions, negative_regions, tile_size, scaling)
 
-    def _serialize_patch(self, patch_img, slide_id, output_folder):
-        f_uuid = uuid4().hex
+    def _get_regions_indexes(self, focus_regions_shapes, scaling):
+        return dict((label, ShapesIndex([r[0] for r in regions], scaling))
+                    for label, regions in focus_regions_shapes.iteritems())
+
+    # fractions of the area of each patch covered by the core, the positive and the negative focus regions,
+    # computed from the shapes without building the masks
+    def _get_coverage_fractions(self, patches_coordinates, core, regions_indexes, scaling):
+        tissue = core.get_coverage_fractions(patches_coordinates, scaling)
+        tumor = regions_indexes['positive'].get_coverage_fractions(patches_coordinates)
+        not_tumor = regions_indexes['negative'].get_coverage_fractions(patches_coordinates)
+        return [{
+            'tissue_fraction': round(t, 6),
+            'tumor_fraction': round(p, 6),
+            'not_tumor_fraction': round(n, 6)
+        } for t, p, n in izip(tissue, tumor, not_tumor)]
+
+    # patch IDs only depend on the input data, a patch extracted again by a restarted run gets the same ID;
+    # origin is the integer pixel the patch is read from, see PatchesExtractor.get_patch_origin
+    def _get_patch_uuid(self, slide_id, scaling, origin, seed):
+        return sha1('%s:%d:%d:%d:%d' % (slide_id, scaling, origin[0], origin[1], seed)).hexdigest()[:32]
+
+    def _get_focus_region_seed(self, slide_id, core_id, focus_region_id, seed):
+        return int(sha1('%s:%s:%s:%d' % (slide_id, core_id, focus_region_id, seed)).hexdigest()[:8], 16)
+
+    def _serialize_patch(self, patch_img, patch_uuid, slide_id, output_folder):
         try:
             os.makedirs(os.path.join(output_folder, slide_id))
         except OSError:
             pass
-        out_file = os.path.join(output_folder, slide_id, '%s.jpeg' % f_uuid)
+        out_file = os.path.join(output_folder, slide_id, '%s.jpeg' % patch_uuid)
         patch_img.save(out_file)
-        return f_uuid
 
-    def _serialize_masks(self, masks, patch_uuid, slide_id, output_folder):
+    def _serialize_masks(self, masks, patch_uuid, slide_id, output_folder, masks_encoding='npz'):
         out_file = os.path.join(output_folder, slide_id, '%s.npz' % patch_uuid)
-        np.savez_compressed(out_file, tissue=masks['tissue'], not_tissue=masks['not_tissue'],
-                            tumor=masks['tumor'], not_tumor=masks['not_tumor'],
-                            cv2_white=masks['cv2_white'])
+        if masks_encoding == 'packed':
+            mmu.save_masks(out_file, masks)
+        else:
+            np.savez_compressed(out_file, tissue=masks['tissue'], not_tissue=masks['not_tissue'],
+                                tumor=masks['tumor'], not_tumor=masks['not_tumor'],
+                                cv2_white=masks['cv2_white'])
+
+    # context patches are saved next to the patch as <patch_uuid>_scale<scaling>.jpeg
+    def _serialize_context_patches(self, context_patches, context_scales, patch_uuid, slide_id, output_folder):
+        for context_patch, context_scale in izip(context_patches, context_scales):
+            out_file = os.path.join(output_folder, slide_id, '%s_scale%d.jpeg' % (patch_uuid, context_scale))
+            Image.fromarray(context_patch).save(out_file)
+
+    def _serialize(self, patch, masks, patch_uuid, slide_id, output_folder, masks_encoding='npz',
+                   context_patches=None, context_scales=None):
+        self._serialize_patch(patch, patch_uuid, slide_id, output_folder)
+        if masks is not None:
+            self._serialize_masks(masks, patch_uuid, slide_id, output_folder, masks_encoding)
+        if context_patches is not None:
+            self._serialize_context_patches(context_patches, context_scales, patch_uuid, slide_id, output_folder)
 
-    def _serialize(self, patch, masks, slide_id, output_folder):
-        patch_uuid = self._serialize_patch(patch, slide_id, output_folder)
-        self._serialize_masks(masks, patch_uuid, slide_id, output_folder)
-        return patch_uuid
+    def _serialize_to_dataset(self, patch, masks, patch_uuid, core_id, focus_region_id, coordinates,
+                              dataset_writer, context_patches=None):
+        dataset_writer.append(patch, masks, patch_uuid, core_id, focus_region_id, coordinates, context_patches)
+
+    def _get_dataset_writer(self, slide_id, output_folder, output_format, patch_size, shard_size, skip_masks,
+                            context_scales_count=0):
+        if output_format == 'arrays':
+            return PatchesDatasetWriter(output_folder, slide_id, patch_size, shard_size, not skip_masks,
+                                        context_scales_count)
+        else:
+            return None
+
+    def _get_journal(self, output_folder):
+        try:
+            os.makedirs(output_folder)
+        except OSError:
+            pass
+        return ExtractionJournal(os.path.join(output_folder, 'extraction_journal.csv'))
+
+    def _load_patches_uuids(self, in_file):
+        if not os.path.isfile(in_file):
+            return set()
+        with open(in_file) as f:
+            return set(row['patch_uuid'] for row in DictReader(f))
+
+    # IDs of the patches already listed in the slide map and of the ones already saved (the index of the dataset
+    # if using the arrays output format), a unit interrupted by a crash may have saved patches not listed in the map
+    def _load_slide_status(self, slide_id, output_folder, output_format):
+        mapped_patches = self._load_patches_uuids(os.path.join(output_folder, slide_id, 'patches_map.csv'))
+        if output_format == 'arrays':
+            stored_patches = self._load_patches_uuids(os.path.join(output_folder, slide_id, 'patches_index.csv'))
+        else:
+            stored_patches = set()
+        return mapped_patches, stored_patches
+
+    # rows are only appended to slide maps written with the current PATCHES_MAP_FIELDS
+    def _check_slide_map(self, slide_id, output_folder):
+        in_file = os.path.join(output_folder, slide_id, 'patches_map.csv')
+        if not os.path.isfile(in_file) or os.path.getsize(in_file) == 0:
+            return True
+        with open(in_file) as f:
+            fields = DictReader(f).fieldnames
+        if fields != PATCHES_MAP_FIELDS:
+            self.logger.error('Patches map %s has columns %r instead of %r, move it away to extract patches from '
+                              'slide %s', in_file, fields, PATCHES_MAP_FIELDS, slide_id)
+            return False
+        return True
 
     def _save_slide_map(self, slide_id, slide_map, output_folder):
         out_file = os.path.join(output_folder, slide_id, 'patches_map.csv')
-        with open(out_file, 'w') as ofile:
-            writer = DictWriter(ofile, ['slide_id', 'focus_region_id', 'patch_uuid'])
-            writer.writeheader()
+        write_header = not os.path.isfile(out_file) or os.path.getsize(out_file) == 0
+        with open(out_file, 'a') as ofile:
+            writer = DictWriter(ofile, PATCHES_MAP_FIELDS)
+            if write_header:
+                writer.writeheader()
             for row in slide_map:
                 writer.writerow(row)
 
-    def _patches_folder_exists(self, slide_id, output_folder):
-        return os.path.isdir(os.path.join(output_folder, slide_id))
-
-    def run(self, focus_regions_list, slides_folder, tile_size, patches_count, scaling, tolerance,
-            white_lower_bound, output_folder):
+    def run(self, focus_regions_list, slides_folder, tile_size, patches_count, scaling, white_lower_bound,
+            output_folder, tiles_cache_size=256, output_format='files', shard_size=1024, seed=0, masks_mode='shapes',
+            masks_encoding='npz', skip_masks=False, context_scales=None, masks_cache_folder=None):
+        context_scales = context_scales or []
+        if masks_cache_folder is not None:
+            try:
+                os.makedirs(masks_cache_folder)
+            except OSError:
+                pass
+        tiles_cache = TilesCache(tiles_cache_size * 1024 * 1024)
+        journal = self._get_journal(output_folder)
+        self.logger.info('%d focus regions already processed', journal.get_completed_count())
         try:
             self.promort_client.login()
             dependencies_tree, positive_regions, negative_regions = self._build_data_mappings(focus_regions_list)
             for slide, cores in dependencies_tree.iteritems():
-                if not self._patches_folder_exists(slide, output_folder):
-                    slide_path = os.path.join(slides_folder, '%s.mrxs' % slide)
-                    slide_map = list()
-                    self.logger.info('Processing file %s', slide_path)
-                    patches_extractor = PatchesExtractor(DeepZoomWrapper(slide_path, tile_size))
-                    for core, focus_regions in cores.iteritems():
-                        core_shape = self.shapes_manager.get_core(slide, core)
-                        self.logger.info('Loading core %s', core)
-                        focus_regions_shapes = self._load_focus_regions(focus_regions, slide,
-                                                                        positive_regions, negative_regions)
-                        self.logger.info('Loaded %d positive shapes and %d negative',
-                                         len(focus_regions_shapes['positive']),
-                                         len(focus_regions_shapes['negative']))
-                        for focus_region in chain(*focus_regions_shapes.values()):
-                            try:
-                                for point in focus_region[0].get_random_points(patches_count):
-                                    processed = False
-                                    tolerance_value = 0.0
-                                    while not processed:
-                                        try:
-                                            patch, coordinates = self._extract_patch(point, scaling, patches_extractor)
-                                            masks = self._build_masks(coordinates, core_shape, focus_regions_shapes['positive'],
-                                                                      focus_regions_shapes['negative'], patch, tile_size,
-                                                                      scaling, tolerance_value, white_lower_bound)
-                                            patch_uuid = self._serialize(patch, masks, slide, output_folder)
-                                            slide_map.append({
-                                                'slide_id': slide,
-                                                'focus_region_id': focus_region[1],
-                                                'patch_uuid': patch_uuid
-                                            })
-                                            processed = True
-                                        except TopologicalError:
-                                            tolerance_value += tolerance
-                                            self.logger.debug('Intersection failed, increasing tolerance to %f',
-                                                              tolerance_value)
-                                        except DZIBadTileAddress, e:
-                                            self.logger.error(e.message)
-                                            processed = True
-                            except InvalidPolygonError:
-                                self.logger.error('FocusRegion is not a valid shape, skipping it')
+                if all(journal.is_completed(slide, core, fr) for core, frs in cores.iteritems() for fr in frs):
+                    self.logger.info('All focus regions of slide %s were already processed, skipping it', slide)
+                    continue
+                if not self._check_slide_map(slide, output_folder):
+                    continue
+                slide_path = os.path.join(slides_folder, '%s.mrxs' % slide)
+                self.logger.info('Processing file %s', slide_path)
+                patches_extractor = PatchesExtractor(DeepZoomWrapper(slide_path, tile_size,
+                                                                     tiles_cache=tiles_cache))
+                mapped_patches, stored_patches = self._load_slide_status(slide, output_folder, output_format)
+                dataset_writer = self._get_dataset_writer(slide, output_folder, output_format, tile_size,
+                                                          shard_size, skip_masks, len(context_scales))
+                for core, focus_regions in cores.iteritems():
+                    if all(journal.is_completed(slide, core, fr) for fr in focus_regions):
+                        continue
+                    self.logger.info('Loading core %s', core)
                     try:
-                        self._save_slide_map(slide, slide_map, output_folder)
-                    except IOError:
-                        self.logger.warning('There is no output folder for slide %s, no focus regions map to save', slide)
-                else:
-                    self.logger.warning('There is already a patches folder for slide %s, skipping it', slide)
+                        core_shape = self.shapes_manager.get_core(slide, core)
+                    except InvalidPolygonError:
+                        self.logger.error('Core %s of slide %s is not a valid shape, skipping it', core, slide)
+                        for focus_region in focus_regions:
+                            if not journal.is_completed(slide, core, focus_region):
+                                journal.mark_completed(slide, core, focus_region, 'invalid_core')
+                        continue
+                    focus_regions_shapes, skipped_regions = self._load_focus_regions(focus_regions, slide,
+                                                                                     positive_regions,
+                                                                                     negative_regions)
+                    for focus_region, status in skipped_regions.iteritems():
+                        if not journal.is_completed(slide, core, focus_region):
+                            journal.mark_completed(slide, core, focus_region, status)
+                    self.logger.info('Loaded %d positive shapes and %d negative',
+                                     len(focus_regions_shapes['positive']),
+                                     len(focus_regions_shapes['negative']))
+                    regions_indexes = self._get_regions_indexes(focus_regions_shapes, scaling)
+                    if skip_masks:
+                        masks_builder = None
+                    else:
+                        masks_builder = self._get_masks_builder(masks_mode, core_shape, focus_regions_shapes,
+                                                                tile_size, scaling, masks_cache_folder)
+                    for focus_region in chain(*focus_regions_shapes.values()):
+                        if journal.is_completed(slide, core, focus_region[1]):
+                            self.logger.debug('Focus region %s was already processed', focus_region[1])
+                            continue
+                        slide_map = list()
+                        status = 'completed'
+                        try:
+                            points = focus_region[0].get_random_points(
+                                patches_count, self._get_focus_region_seed(slide, core, focus_region[1], seed)
+                            )
+                            patches, patches_coordinates = self._extract_patches(points, scaling,
+                                                                                 patches_extractor)
+                            coverage_fractions = self._get_coverage_fractions(patches_coordinates, core_shape,
+                                                                              regions_indexes, scaling)
+                            for point, patch, coordinates, fractions in izip(points, patches, patches_coordinates,
+                                                                             coverage_fractions):
+                                origin = PatchesExtractor.get_patch_origin(coordinates)
+                                patch_uuid = self._get_patch_uuid(slide, scaling, origin, seed)
+                                if patch_uuid not in stored_patches and patch_uuid not in mapped_patches:
+                                    patch = Image.fromarray(patch)
+                                    if skip_masks:
+                                        masks = None
+                                    else:
+                                        masks = self._build_masks(coordinates, masks_builder, patch,
+                                                                  white_lower_bound)
+                                    if context_scales:
+                                        context_patches = self._extract_context_patches(point, context_scales,
+                                                                                        patches_extractor)
+                                    else:
+                                        context_patches = None
+                                    if dataset_writer is None:
+                                        self._serialize(patch, masks, patch_uuid, slide, output_folder,
+                                                        masks_encoding, context_patches, context_scales)
+                                    else:
+                                        self._serialize_to_dataset(patch, masks, patch_uuid, core,
+                                                                   focus_region[1], coordinates, dataset_writer,
+                                                                   context_patches)
+                                    stored_patches.add(patch_uuid)
+                                if patch_uuid not in mapped_patches:
+                                    fractions.update({
+                                        'slide_id': slide,
+                                        'focus_region_id': focus_region[1],
+                                        'patch_uuid': patch_uuid,
+                                        'x': origin[0],
+                                        'y': origin[1]
+                                    })
+                                    slide_map.append(fractions)
+                                    mapped_patches.add(patch_uuid)
+                        except InvalidPolygonError:
+                            self.logger.error('FocusRegion is not a valid shape, skipping it')
+                            status = 'invalid_shape'
+                        # patches, then the map and finally the journal: a crash at any point of this sequence
+                        # only makes the restarted run process the focus region again
+                        if dataset_writer is not None:
+                            dataset_writer.flush()
+                        if slide_map:
+                            self._save_slide_map(slide, slide_map, output_folder)
+                        journal.mark_completed(slide, core, focus_region[1], status)
+                    if masks_mode == 'raster' and masks_builder is not None:
+                        masks_builder.close()
+                if dataset_writer is not None:
+                    dataset_writer.close()
+                self.logger.debug('Tiles cache status: %r', tiles_cache.get_stats())
             self.promort_client.logout()
         except UserNotAllowed, e:
             self.logger.error('UserNotAllowedError: %r', e.message)
@@ -204,9 +356,14 @@ add doc
 
 
 def implementation(host, user, passwd, logger, args):
+    if args.tolerance is not None:
+        logger.warning('--simplify-tolerance is deprecated and will be ignored, shapes are validated and repaired '
+                       'when they are loaded')
     patches_extractor = RandomPatchesExtractor(host, user, passwd, logger)
     patches_extractor.run(args.focus_regions_list, args.slides_folder, args.tile_size, args.patches_count,
-                          args.scaling, args.tolerance, args.white_lower_bound, args.output_folder)
+                          args.scaling, args.white_lower_bound, args.output_folder,
+                          args.tiles_cache_size, args.output_format, args.shard_size, args.seed, args.masks_mode,
+                          args.masks_encoding, args.skip_masks, args.context_scales, args.masks_cache_folder)
 
 
 def make_parser(parser):
@@ -217,11 +374,29 @@ def make_parser(parser):
     parser.add_argument('--patches-count', type=int, required=True,
                         help='the number of patches that will be extracted for each focus region')
     parser.add_argument('--scaling', type=int, default=0, help='scaling level expressed as a negative number')
-    parser.add_argument('--simplify-tolerance', dest='tolerance', type=float, default=10.,
-                        help='the tolerance step that will be used to simplify shapes that fail in the intersection')
+    parser.add_argument('--simplify-tolerance', dest='tolerance', type=float, default=None,
+                        help='DEPRECATED, ignored: shapes are validated and repaired when they are loaded')
     parser.add_argument('--lower-white', dest='white_lower_bound', type=int, default=230,
                         help='the lower boundary used for automatic white identification')
     parser.add_argument('--output-folder', type=str, required=True, help='output folder for patches and masks')
+    parser.add_argument('--tiles-cache-size', type=int, default=256,
+                        help='memory budget (in MB) of the cache used for the tiles read from the slides')
+    parser.add_argument('--output-format', type=str, choices=['files', 'arrays'], default='files',
+                        help='save each patch as a JPEG file plus a NPZ file with its masks (files) or append patches and masks to .npy shards for each slide (arrays)')
+    parser.add_argument('--shard-size', type=int, default=1024,
+                        help='number of patches stored in each .npy shard when using the arrays output format')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed used to extract the random patches, a restarted run must use the same seed')
+    parser.add_argument('--masks-mode', type=str, choices=['shapes', 'raster'], default='shapes',
+                        help='build the masks of each patch intersecting it with the shapes (shapes) or rasterise each core and its focus regions once and slice the masks out of the raster (raster)')
+    parser.add_argument('--masks-cache-folder', type=str, default=None,
+                        help='folder for the temporary files backing the rasters of big cores when using the raster masks mode (default: the system temporary folder)')
+    parser.add_argument('--masks-encoding', type=str, choices=['npz', 'packed'], default='npz',
+                        help='save the masks of each patch as one array per mask (npz) or as bit-packed planes with constant masks stored as a single value (packed), packed masks can be read with odin.libs.masks_manager.utils.load_masks')
+    parser.add_argument('--scales', dest='context_scales', type=int, nargs='+', default=[],
+                        help='scaling levels (as negative numbers) of the context patches extracted around the center of each patch, saved as <patch>_scale<level>.jpeg files or in context_<shard>.npy arrays')
+    parser.add_argument('--skip-masks', action='store_true',
+                        help='do not build and save the masks of the patches, the tissue, tumor and not tumor coverage fractions are always written in the patches map')
 
 
 def register(registration_list):
@@ -0,0 +1,139 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+from csv import DictReader
+import numpy as np
+
+from odin.libs.patches.dataset_writer import PatchesDatasetWriter, load_patches_dataset, load_context_patches, \
+    MASKS_LABELS
+
+PATCH_SIZE = 8
+
+
+def get_patch(value):
+    return np.full((PATCH_SIZE, PATCH_SIZE, 3), value, dtype=np.uint8)
+
+
+def get_masks(value):
+    return dict((label, np.full((PATCH_SIZE, PATCH_SIZE), (value + i) % 2, dtype=np.uint8))
+                for i, label in enumerate(MASKS_LABELS))
+
+
+def get_coordinates(x, y):
+    return {
+        'up_left': (x, y),
+        'up_right': (x + PATCH_SIZE, y),
+        'down_right': (x + PATCH_SIZE, y + PATCH_SIZE),
+        'down_left': (x, y + PATCH_SIZE)
+    }
+
+
+class TestPatchesDatasetWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.slide_folder = os.path.join(self.output_folder, 'S1')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def _append(self, writer, values):
+        for v in values:
+            writer.append(get_patch(v), get_masks(v), 'P%d' % v, 'C1', 'F1', get_coordinates(v + 0.5, v))
+
+    def _load_index(self):
+        with open(os.path.join(self.slide_folder, 'patches_index.csv')) as f:
+            return list(DictReader(f))
+
+    def test_last_shard_is_truncated(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4)
+        self._append(writer, range(6))
+        writer.close()
+        patches, masks = load_patches_dataset(self.slide_folder, 0)
+        self.assertEqual(patches.shape, (4, PATCH_SIZE, PATCH_SIZE, 3))
+        patches, masks = load_patches_dataset(self.slide_folder, 1)
+        self.assertEqual(patches.shape, (2, PATCH_SIZE, PATCH_SIZE, 3))
+        self.assertEqual(masks.shape, (2, len(MASKS_LABELS), PATCH_SIZE, PATCH_SIZE))
+        self.assertEqual(patches[1, 0, 0, 0], 5)
+        self.assertTrue(np.array_equal(masks[1, 0], get_masks(5)['tissue']))
+        self.assertFalse(os.path.isfile(os.path.join(self.slide_folder, 'patches_00002.npy')))
+
+    def test_index_stores_patch_origins(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4)
+        self._append(writer, range(6))
+        writer.close()
+        index = self._load_index()
+        self.assertEqual([(r['shard'], r['offset']) for r in index],
+                         [('0', '0'), ('0', '1'), ('0', '2'), ('0', '3'), ('1', '0'), ('1', '1')])
+        # up_left of patch v is (v + 0.5, v), patches are read from floor(x + 0.5)
+        self.assertEqual([(r['x'], r['y']) for r in index], [(str(v + 1), str(v)) for v in xrange(6)])
+
+    def test_resume_after_crash(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4)
+        self._append(writer, range(3))
+        writer.flush()
+        # a patch appended after the last flush is not listed in the index
+        self._append(writer, [3])
+        # the writer is not closed, as if the process crashed
+        del writer
+        self.assertEqual([r['patch_uuid'] for r in self._load_index()], ['P0', 'P1', 'P2'])
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4)
+        self._append(writer, [3, 4])
+        writer.close()
+        index = self._load_index()
+        self.assertEqual([r['patch_uuid'] for r in index], ['P0', 'P1', 'P2', 'P3', 'P4'])
+        for row in index:
+            patches, _ = load_patches_dataset(self.slide_folder, int(row['shard']))
+            self.assertEqual(patches[int(row['offset']), 0, 0, 0], int(row['patch_uuid'][1:]))
+        patches, _ = load_patches_dataset(self.slide_folder, 1)
+        self.assertEqual(len(patches), 2)
+
+    def test_without_masks(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4, with_masks=False)
+        writer.append(get_patch(1), None, 'P1', 'C1', 'F1', get_coordinates(0, 0))
+        writer.close()
+        patches, masks = load_patches_dataset(self.slide_folder, 0)
+        self.assertEqual(len(patches), 1)
+        self.assertIsNone(masks)
+
+
+    def test_context_patches(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4, context_scales_count=2)
+        for v in xrange(5):
+            writer.append(get_patch(v), get_masks(v), 'P%d' % v, 'C1', 'F1', get_coordinates(v, v),
+                          np.stack([get_patch(v + 10), get_patch(v + 20)]))
+        writer.close()
+        self.assertEqual(load_context_patches(self.slide_folder, 0).shape, (4, 2, PATCH_SIZE, PATCH_SIZE, 3))
+        context = load_context_patches(self.slide_folder, 1)
+        self.assertEqual(context.shape, (1, 2, PATCH_SIZE, PATCH_SIZE, 3))
+        self.assertEqual((context[0, 0, 0, 0, 0], context[0, 1, 0, 0, 0]), (14, 24))
+
+    def test_without_context_patches(self):
+        writer = PatchesDatasetWriter(self.output_folder, 'S1', PATCH_SIZE, shard_size=4)
+        self._append(writer, range(2))
+        writer.close()
+        self.assertIsNone(load_context_patches(self.slide_folder, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+from odin.libs.deepzoom.deepzoom_wrapper import DeepZoomWrapper
+from odin.libs.deepzoom.slides_pool import SlidesPool
+from odin.libs.deepzoom.tiles_cache import TilesCache
+
+TILE_SIZE = 128
+SLIDE_WIDTH = 1000
+SLIDE_HEIGHT = 700
+
+
+def write_pyramid(slide_path, level_img):
+    with tifffile.TiffWriter(slide_path, bigtiff=True) as tiff_writer:
+        subfile_type = 0
+        while min(level_img.shape[:2]) >= TILE_SIZE:
+            tiff_writer.save(level_img, tile=(TILE_SIZE, TILE_SIZE), photometric='rgb', subfiletype=subfile_type)
+            level_img = cv2.resize(level_img, (level_img.shape[1] / 2, level_img.shape[0] / 2),
+                                   interpolation=cv2.INTER_AREA)
+            subfile_type = 1
+
+
+# pyramidal TIFF with random pixels, so that any misplaced pixel changes the regions read
+def build_slide(slide_path):
+    write_pyramid(slide_path, np.random.RandomState(0).randint(0, 256, (SLIDE_HEIGHT, SLIDE_WIDTH, 3)).astype(np.uint8))
+
+
+class TestReadRegion(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if tifffile is None:
+            raise unittest.SkipTest('tifffile is required to build the test slide')
+        cls.slides_folder = tempfile.mkdtemp()
+        cls.slide_path = os.path.join(cls.slides_folder, 'slide.tiff')
+        build_slide(cls.slide_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slides_folder)
+
+    def setUp(self):
+        self.slides_pool = SlidesPool()
+        self.wrapper = DeepZoomWrapper(self.slide_path, TILE_SIZE, tiles_cache=TilesCache(),
+                                       slides_pool=self.slides_pool)
+
+    def tearDown(self):
+        self.slides_pool.close_all()
+
+    # the whole DeepZoom level assembled from the tiles of the generator, padded with white; levels of the
+    # wrapper start from 1 while the ones of the generator start from 0
+    def _get_level_from_tiles(self, level):
+        generator = self.wrapper.dzi_wrapper
+        columns, rows = generator.level_tiles[level - 1]
+        level_img = np.full((rows * TILE_SIZE, columns * TILE_SIZE, 3), 255, dtype=np.uint8)
+        for column in xrange(columns):
+            for row in xrange(rows):
+                tile = np.asarray(generator.get_tile(level - 1, (column, row)).convert('RGB'))
+                level_img[row * TILE_SIZE:row * TILE_SIZE + tile.shape[0],
+                          column * TILE_SIZE:column * TILE_SIZE + tile.shape[1]] = tile
+        return level_img
+
+    def _assert_region(self, level, level_img, x, y, width, height):
+        region = np.asarray(self.wrapper.read_region(level, x, y, width, height))
+        self.assertEqual(region.shape, (height, width, 3))
+        expected = np.full((height, width, 3), 255, dtype=np.uint8)
+        x_min, y_min = max(x, 0), max(y, 0)
+        x_max = min(x + width, level_img.shape[1])
+        y_max = min(y + height, level_img.shape[0])
+        if x_max > x_min and y_max > y_min:
+            expected[y_min - y:y_max - y, x_min - x:x_max - x] = level_img[y_min:y_max, x_min:x_max]
+        self.assertTrue(np.array_equal(region, expected), (level, x, y, width, height))
+
+    # DeepZoom levels backed by a native level of the slide must match the tiles pixel by pixel
+    def test_native_levels(self):
+        max_level = self.wrapper.get_max_zoom_level()
+        for level in (max_level, max_level - 1):
+            resolution = self.wrapper.get_level_resolution(level)
+            level_img = self._get_level_from_tiles(level)[:resolution['height'], :resolution['width']]
+            for x, y, width, height in ((0, 0, TILE_SIZE, TILE_SIZE), (37, 201, 256, 256), (100, 50, 7, 300),
+                                        (resolution['width'] - 60, resolution['height'] - 30, 128, 128),
+                                        (-40, -20, 100, 100), (resolution['width'] + 10, 0, 32, 32)):
+                self._assert_region(level, level_img, x, y, width, height)
+
+    def test_read_regions_batch(self):
+        level = self.wrapper.get_max_zoom_level()
+        windows = [(level, 5, 9, 64, 64), (level, 300, 200, 128, 128), (level - 1, 10, 20, 64, 64)]
+        regions = self.wrapper.read_regions(windows)
+        for window, region in zip(windows, regions):
+            self.assertTrue(np.array_equal(np.asarray(region), np.asarray(self.wrapper.read_region(*window))))
+
+    # the pool may close the slide between two reads, it is reopened transparently
+    def test_read_after_pool_closed_slide(self):
+        level = self.wrapper.get_max_zoom_level()
+        region = np.asarray(self.wrapper.read_region(level, 33, 44, 128, 128))
+        self.slides_pool.close(self.wrapper.image_path)
+        self.assertTrue(np.array_equal(np.asarray(self.wrapper.read_region(level, 33, 44, 128, 128)), region))
+
+
+class TestTissueIndex(unittest.TestCase):
+
+    # white slide where a few tiles contain only a handful of pixels just below the white bound
+    @classmethod
+    def setUpClass(cls):
+        if tifffile is None:
+            raise unittest.SkipTest('tifffile is required to build the test slide')
+        cls.slides_folder = tempfile.mkdtemp()
+        cls.slide_path = os.path.join(cls.slides_folder, 'sparse.tiff')
+        level_img = np.full((1536, 2048, 3), 255, dtype=np.uint8)
+        random_state = np.random.RandomState(0)
+        # (column, row) of the tiles of the highest resolution level and number of tissue pixels in each of them
+        cls.sparse_tiles = {(3, 2): 1, (10, 5): 5, (15, 11): 1, (0, 11): 20}
+        for (column, row), pixels_count in cls.sparse_tiles.iteritems():
+            ys = row * TILE_SIZE + random_state.randint(0, TILE_SIZE, pixels_count)
+            xs = column * TILE_SIZE + random_state.randint(0, TILE_SIZE, pixels_count)
+            level_img[ys, xs, random_state.randint(0, 3, pixels_count)] = 229
+        write_pyramid(cls.slide_path, level_img)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slides_folder)
+
+    def setUp(self):
+        self.slides_pool = SlidesPool()
+        self.wrapper = DeepZoomWrapper(self.slide_path, TILE_SIZE, tiles_cache=TilesCache(),
+                                       slides_pool=self.slides_pool)
+
+    def tearDown(self):
+        self.slides_pool.close_all()
+
+    # tiles containing at least one pixel below the white bound, checked on the full tiles of the level
+    def _get_tissue_tiles(self, level):
+        grid = self.wrapper.get_level_grid(level)
+        tissue_tiles = np.zeros((grid['rows'], grid['columns']), dtype=np.bool)
+        for row in xrange(grid['rows']):
+            for column in xrange(grid['columns']):
+                tile = self.wrapper.get_tile_array(level, column, row)
+                tissue_tiles[row, column] = np.any(tile < 230)
+        return tissue_tiles
+
+    def test_sparse_tissue_is_kept(self):
+        level = self.wrapper.get_max_zoom_level()
+        tissue_index = self.wrapper.get_tissue_index(level, 230, margin=0, stripe_height=100)
+        for column, row in self.sparse_tiles:
+            self.assertTrue(tissue_index[row, column], (column, row))
+        self.assertEqual(tissue_index.sum(), len(self.sparse_tiles))
+
+    def test_index_covers_tissue_tiles(self):
+        max_level = self.wrapper.get_max_zoom_level()
+        for level in (max_level, max_level - 1, max_level - 2):
+            tissue_tiles = self._get_tissue_tiles(level)
+            tissue_index = self.wrapper.get_tissue_index(level, 230, margin=0)
+            self.assertFalse(np.any(tissue_tiles & ~tissue_index), level)
+
+
+if __name__ == '__main__':
+    unittest.main()
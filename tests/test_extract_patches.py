@@ -0,0 +1,94 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from odin.libs.patches.patches_extractor import PatchesExtractor
+from odin.tools.extract_patches import RandomPatchesExtractor, PATCHES_MAP_FIELDS
+
+
+def get_coordinates(x, y, size=256):
+    return {
+        'up_left': (x, y),
+        'up_right': (x + size, y),
+        'down_right': (x + size, y + size),
+        'down_left': (x, y + size)
+    }
+
+
+class TestPatchesUUIDs(unittest.TestCase):
+
+    def setUp(self):
+        self.extractor = RandomPatchesExtractor.__new__(RandomPatchesExtractor)
+
+    def _get_uuid(self, x, y, seed=0):
+        origin = PatchesExtractor.get_patch_origin(get_coordinates(x, y))
+        return self.extractor._get_patch_uuid('S1', -1, origin, seed)
+
+    def test_origin_matches_read_pixel(self):
+        self.assertEqual(PatchesExtractor.get_patch_origin(get_coordinates(372.0, 10.49)), (372, 10))
+        self.assertEqual(PatchesExtractor.get_patch_origin(get_coordinates(372.5, 10.5)), (373, 11))
+
+    def test_distinct_origins_get_distinct_uuids(self):
+        self.assertNotEqual(self._get_uuid(372.0, 100.0), self._get_uuid(372.5, 100.0))
+        self.assertNotEqual(self._get_uuid(372.0, 100.0), self._get_uuid(372.0, 100.0, seed=1))
+
+    def test_same_origin_gets_same_uuid(self):
+        self.assertEqual(self._get_uuid(372.0, 100.0), self._get_uuid(371.7, 99.9))
+        self.assertEqual(len(self._get_uuid(0, 0)), 32)
+
+
+class TestSlideMap(unittest.TestCase):
+
+    def setUp(self):
+        self.extractor = RandomPatchesExtractor.__new__(RandomPatchesExtractor)
+        self.extractor.logger = logging.getLogger('test_extract_patches')
+        self.extractor.logger.addHandler(logging.NullHandler())
+        self.output_folder = tempfile.mkdtemp()
+        self.map_file = os.path.join(self.output_folder, 'S1', 'patches_map.csv')
+        os.makedirs(os.path.dirname(self.map_file))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def _get_row(self, patch_uuid):
+        row = dict((field, 0) for field in PATCHES_MAP_FIELDS)
+        row.update({'slide_id': 'S1', 'focus_region_id': 'F1', 'patch_uuid': patch_uuid})
+        return row
+
+    def test_rows_are_appended_to_current_map(self):
+        self.assertTrue(self.extractor._check_slide_map('S1', self.output_folder))
+        self.extractor._save_slide_map('S1', [self._get_row('a')], self.output_folder)
+        self.assertTrue(self.extractor._check_slide_map('S1', self.output_folder))
+        self.extractor._save_slide_map('S1', [self._get_row('b')], self.output_folder)
+        self.assertEqual(self.extractor._load_patches_uuids(self.map_file), set(['a', 'b']))
+
+    # maps written before the coverage fractions were added have a different header
+    def test_old_map_is_not_extended(self):
+        with open(self.map_file, 'w') as f:
+            f.write('slide_id,focus_region_id,patch_uuid\nS1,F1,a\n')
+        self.assertFalse(self.extractor._check_slide_map('S1', self.output_folder))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+from csv import DictReader
+
+from odin.libs.patches.extraction_journal import ExtractionJournal, JOURNAL_FIELDS
+
+
+class TestExtractionJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.output_folder, 'extraction_journal.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def test_completed_units_survive_restart(self):
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 0)
+        journal.mark_completed('S1', 'C1', 'F1')
+        journal.mark_completed('S1', 'C1', 'F2')
+        self.assertTrue(journal.is_completed('S1', 'C1', 'F1'))
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 2)
+        self.assertTrue(journal.is_completed('S1', 'C1', 'F2'))
+        self.assertFalse(journal.is_completed('S1', 'C2', 'F1'))
+
+    def test_partial_last_line_is_dropped(self):
+        journal = ExtractionJournal(self.journal_file)
+        journal.mark_completed('S1', 'C1', 'F1')
+        # a crash while writing the next line leaves it incomplete
+        with open(self.journal_file, 'a') as f:
+            f.write('S1,C1,F')
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 1)
+        self.assertFalse(journal.is_completed('S1', 'C1', 'F'))
+        journal.mark_completed('S1', 'C1', 'F2')
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 2)
+        self.assertTrue(journal.is_completed('S1', 'C1', 'F2'))
+
+    def test_empty_journal_file(self):
+        open(self.journal_file, 'w').close()
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 0)
+        journal.mark_completed('S1', 'C1', 'F1')
+        self.assertEqual(ExtractionJournal(self.journal_file).get_completed_count(), 1)
+
+
+    def test_skipped_units_are_completed(self):
+        journal = ExtractionJournal(self.journal_file)
+        journal.mark_completed('S1', 'C1', 'F1', 'unclassified')
+        journal.mark_completed('S1', 'C2', 'F2', 'invalid_core')
+        journal = ExtractionJournal(self.journal_file)
+        self.assertTrue(journal.is_completed('S1', 'C1', 'F1'))
+        self.assertTrue(journal.is_completed('S1', 'C2', 'F2'))
+        with open(self.journal_file) as f:
+            rows = list(DictReader(f))
+        self.assertEqual([r['status'] for r in rows], ['unclassified', 'invalid_core'])
+
+    # journals written without the status column are rewritten with the current header before appending to them
+    def test_journal_without_status_is_upgraded(self):
+        with open(self.journal_file, 'w') as f:
+            f.write('slide_id,core_id,focus_region_id\nS1,C1,F1\nS1,C1,F2\n')
+        journal = ExtractionJournal(self.journal_file)
+        self.assertEqual(journal.get_completed_count(), 2)
+        journal.mark_completed('S1', 'C2', 'F3', 'invalid_shape')
+        with open(self.journal_file) as f:
+            reader = DictReader(f)
+            rows = list(reader)
+        self.assertEqual(reader.fieldnames, JOURNAL_FIELDS)
+        self.assertEqual([(r['focus_region_id'], r['status']) for r in rows],
+                         [('F1', 'completed'), ('F2', 'completed'), ('F3', 'invalid_shape')])
+        self.assertEqual(ExtractionJournal(self.journal_file).get_completed_count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
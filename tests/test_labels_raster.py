@@ -0,0 +1,85 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from odin.libs.regions_of_interest.shapes_manager import Shape
+from odin.libs.masks_manager.labels_raster import LabelsRaster
+from odin.libs.masks_manager.masks_builder import PatchMasksBuilder, MASKS_PLANES
+
+PATCH_SIZE = 256
+
+
+def get_box(x, y):
+    return {
+        'up_left': (x, y),
+        'up_right': (x + PATCH_SIZE, y),
+        'down_right': (x + PATCH_SIZE, y + PATCH_SIZE),
+        'down_left': (x, y + PATCH_SIZE)
+    }
+
+
+class TestLabelsRaster(unittest.TestCase):
+
+    def setUp(self):
+        self.core = Shape([(200, 200), (4000, 300), (4500, 3000), (300, 3400)])
+        # the positive region crosses the border of the core, the negative one has slanted edges only
+        self.positive = [Shape([(3800, 2500), (5000, 2500), (5000, 3600), (3800, 3600)])]
+        self.negative = [Shape([(100, 100), (700, 120), (650, 800)]), Shape([(1500, 1500), (2600, 1700), (1900, 2600)])]
+        self.cache_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_folder)
+
+    # raster masks are sliced at the origin read by the extractor, shapes masks are built on the same integer box;
+    # the two rasterisations only differ along the slanted edges of the shapes
+    def test_raster_matches_shapes(self):
+        for scale_level in (0, -1):
+            raster = LabelsRaster(self.core, self.positive, self.negative, PATCH_SIZE, scale_level)
+            builder = PatchMasksBuilder(self.core, self.positive, self.negative, PATCH_SIZE, scale_level)
+            random_state = np.random.RandomState(0)
+            differences = dict((plane, 0) for plane in MASKS_PLANES)
+            patches_count = 75
+            for x, y in random_state.uniform(0, 5200 * pow(2, scale_level), (patches_count, 2)):
+                raster_masks = raster.get_masks(get_box(x, y))
+                x, y = np.floor(np.array([x, y]) + 0.5)
+                shapes_masks = builder.get_masks(get_box(x, y))
+                for plane in MASKS_PLANES:
+                    self.assertEqual(raster_masks[plane].shape, (PATCH_SIZE, PATCH_SIZE))
+                    differences[plane] += np.count_nonzero(raster_masks[plane] != shapes_masks[plane])
+            pixels_count = patches_count * PATCH_SIZE * PATCH_SIZE
+            for plane in MASKS_PLANES:
+                self.assertLess(differences[plane], pixels_count * 0.001, (scale_level, plane, differences))
+            # edges of the positive region are parallel to the axes
+            self.assertEqual(differences['tumor'], 0)
+
+    def test_memmap_in_cache_folder(self):
+        in_memory = LabelsRaster(self.core, self.positive, self.negative, PATCH_SIZE)
+        memmapped = LabelsRaster(self.core, self.positive, self.negative, PATCH_SIZE, cache_folder=self.cache_folder,
+                                 memmap_threshold=0)
+        self.assertIsInstance(memmapped.raster, np.memmap)
+        self.assertNotIsInstance(in_memory.raster, np.memmap)
+        self.assertTrue(np.array_equal(memmapped.raster, in_memory.raster))
+        memmapped.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+import numpy as np
+
+from odin.libs.regions_of_interest.shapes_manager import Shape
+from odin.libs.masks_manager.masks_builder import PatchMasksBuilder, MASKS_PLANES
+
+PATCH_SIZE = 128
+
+
+def get_box(x, y):
+    return {
+        'up_left': (x, y),
+        'up_right': (x + PATCH_SIZE, y),
+        'down_right': (x + PATCH_SIZE, y + PATCH_SIZE),
+        'down_left': (x, y + PATCH_SIZE)
+    }
+
+
+# the masks built by extract_patches before PatchMasksBuilder, one shape at a time
+def get_baseline_masks(box, core, positive_regions, negative_regions, scale_level):
+    masks = {
+        'tissue': core.get_intersection_mask(box, scale_level),
+        'not_tissue': core.get_difference_mask(box, scale_level)
+    }
+    for label, regions in (('tumor', positive_regions), ('not_tumor', negative_regions)):
+        mask = np.zeros((PATCH_SIZE, PATCH_SIZE), np.uint8)
+        for r in regions:
+            mask = np.uint8(np.logical_or(mask, r.get_intersection_mask(box, scale_level)))
+        masks[label] = mask
+    return masks
+
+
+class TestPatchMasksBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.core = Shape([(200, 200), (2000, 300), (2300, 1500), (300, 1700)])
+        # the two positive regions overlap each other and the first one crosses the border of the core
+        self.positive = [Shape([(1800, 1200), (2500, 1200), (2500, 1800), (1800, 1800)]),
+                         Shape([(1500, 900), (2100, 1000), (1900, 1500)])]
+        self.negative = [Shape([(100, 100), (700, 120), (650, 800)])]
+
+    def test_masks_match_baseline(self):
+        for scale_level in (0, -1):
+            builder = PatchMasksBuilder(self.core, self.positive, self.negative, PATCH_SIZE, scale_level)
+            random_state = np.random.RandomState(0)
+            # random boxes plus a box outside of every shape
+            origins = [tuple(o) for o in random_state.uniform(-100, 2600 * 2 ** scale_level, (60, 2))]
+            origins.append((5000.0, 5000.0))
+            for x, y in origins:
+                box = get_box(x, y)
+                masks = builder.get_masks(box)
+                baseline = get_baseline_masks(box, self.core, self.positive, self.negative, scale_level)
+                for label in MASKS_PLANES:
+                    self.assertEqual(masks[label].dtype, np.uint8)
+                    self.assertTrue(np.array_equal(masks[label], baseline[label]), (scale_level, x, y, label))
+
+    def test_masks_are_not_overwritten(self):
+        builder = PatchMasksBuilder(self.core, self.positive, self.negative, PATCH_SIZE)
+        first_box, second_box = get_box(1700.0, 1100.0), get_box(5000.0, 5000.0)
+        masks = builder.get_masks(first_box)
+        expected = dict((label, mask.copy()) for label, mask in masks.iteritems())
+        self.assertTrue(masks['tumor'].any())
+        builder.get_masks(second_box)
+        for label in MASKS_PLANES:
+            self.assertTrue(np.array_equal(masks[label], expected[label]), label)
+
+
+if __name__ == '__main__':
+    unittest.main()
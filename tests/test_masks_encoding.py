@@ -0,0 +1,80 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from odin.libs.masks_manager.utils import encode_masks, decode_masks, save_masks, load_masks
+
+
+class TestPackedMasks(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        # odd sizes, so that the packed planes don't end on a byte boundary
+        self.masks = {
+            'tissue': (random_state.uniform(size=(13, 11)) > 0.3).astype(np.uint8),
+            'not_tissue': np.zeros((13, 11), dtype=np.uint8),
+            'tumor': np.ones((13, 11), dtype=np.uint8),
+            'not_tumor': (random_state.uniform(size=(13, 11)) > 0.7).astype(np.uint8),
+            'cv2_white': np.eye(13, 11, dtype=np.uint8)
+        }
+        self.output_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def _assert_masks_equal(self, masks):
+        self.assertEqual(sorted(masks), sorted(self.masks))
+        for label, mask in self.masks.iteritems():
+            self.assertEqual(masks[label].dtype, np.uint8)
+            self.assertTrue(np.array_equal(masks[label], mask), label)
+
+    def test_round_trip(self):
+        self._assert_masks_equal(decode_masks(encode_masks(self.masks)))
+
+    def test_constant_masks_are_not_packed(self):
+        encoded = encode_masks(self.masks)
+        # tissue, not_tumor and cv2_white take 13 * 11 bits each
+        self.assertEqual(len(encoded['bits']), (3 * 13 * 11 + 7) // 8)
+
+    def test_constant_masks_keep_their_value(self):
+        masks = decode_masks(encode_masks({'a': np.full((4, 4), 255, dtype=np.uint8)}))
+        self.assertTrue(np.all(masks['a'] == 255))
+
+    def test_invalid_masks(self):
+        self.assertRaises(ValueError, encode_masks, {'a': np.arange(4, dtype=np.uint8).reshape(2, 2)})
+        self.assertRaises(ValueError, encode_masks, {'a': np.zeros((2, 2)), 'b': np.zeros((3, 2))})
+
+    def test_save_and_load(self):
+        out_file = os.path.join(self.output_folder, 'packed.npz')
+        save_masks(out_file, self.masks)
+        self._assert_masks_equal(load_masks(out_file))
+
+    def test_load_legacy_masks(self):
+        out_file = os.path.join(self.output_folder, 'legacy.npz')
+        np.savez_compressed(out_file, **self.masks)
+        self._assert_masks_equal(load_masks(out_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+from odin.libs.deepzoom.deepzoom_wrapper import DeepZoomWrapper
+from odin.libs.deepzoom.slides_pool import SlidesPool
+from odin.libs.deepzoom.tiles_cache import TilesCache
+from odin.libs.patches.patches_extractor import PatchesExtractor
+
+from test_deepzoom_wrapper import build_slide, TILE_SIZE, SLIDE_WIDTH, SLIDE_HEIGHT
+
+
+class TestPatchesExtractor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if tifffile is None:
+            raise unittest.SkipTest('tifffile is required to build the test slide')
+        cls.slides_folder = tempfile.mkdtemp()
+        cls.slide_path = os.path.join(cls.slides_folder, 'slide.tiff')
+        build_slide(cls.slide_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slides_folder)
+
+    def setUp(self):
+        self.slides_pool = SlidesPool()
+        self.wrapper = DeepZoomWrapper(self.slide_path, TILE_SIZE, tiles_cache=TilesCache(),
+                                       slides_pool=self.slides_pool)
+        # centers inside a tile, on tiles corners, on the borders of the slide and outside of it
+        self.centers = [(300.0, 200.0), (2 * TILE_SIZE, 3 * TILE_SIZE), (TILE_SIZE + 0.5, 17.3),
+                        (SLIDE_WIDTH - 10.0, SLIDE_HEIGHT - 40.0), (5.0, SLIDE_HEIGHT / 2.0), (-30.0, 20.0)]
+
+    def tearDown(self):
+        self.slides_pool.close_all()
+
+    def test_pyramid_matches_patches(self):
+        scale_factors = [0, -1, -2]
+        for patch_size in (TILE_SIZE, 100, 300):
+            extractor = PatchesExtractor(self.wrapper, patch_size)
+            for center in self.centers:
+                pyramid, pyramid_vertices = extractor.get_patch_pyramid(center, scale_factors)
+                self.assertEqual(pyramid.shape, (len(scale_factors), patch_size, patch_size, 3))
+                for level_patch, level_vertices, scale_factor in zip(pyramid, pyramid_vertices, scale_factors):
+                    patch, patch_vertices = extractor.get_patch(center, scale_factor)
+                    self.assertEqual(level_vertices, patch_vertices)
+                    self.assertTrue(np.array_equal(level_patch, np.asarray(patch)),
+                                    (patch_size, center, scale_factor))
+
+    def test_batch_matches_patches(self):
+        for patch_size in (TILE_SIZE, 100, 300):
+            extractor = PatchesExtractor(self.wrapper, patch_size)
+            for scale_factor in (0, -1, -2):
+                patches, patches_vertices = extractor.get_patches(np.array(self.centers), scale_factor)
+                self.assertEqual(patches.shape, (len(self.centers), patch_size, patch_size, 3))
+                for center, batch_patch, batch_vertices in zip(self.centers, patches, patches_vertices):
+                    patch, patch_vertices = extractor.get_patch(center, scale_factor)
+                    self.assertEqual(batch_vertices, patch_vertices)
+                    self.assertTrue(np.array_equal(batch_patch, np.asarray(patch)),
+                                    (patch_size, center, scale_factor))
+
+    def test_empty_batch(self):
+        patches, patches_vertices = PatchesExtractor(self.wrapper, 100).get_patches(np.empty((0, 2)))
+        self.assertEqual(patches.shape, (0, 100, 100, 3))
+        self.assertEqual(patches_vertices, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import unittest
+import numpy as np
+from shapely.geometry import Polygon, Point
+
+from odin.libs.regions_of_interest.errors import InvalidPolygonError
+from odin.libs.regions_of_interest.shapes_manager import Shape
+from odin.libs.regions_of_interest.shapes_collection import ShapeCollection
+
+
+# random star-shaped polygons, concave but never self-intersecting
+def get_polygons(count, random_state):
+    polygons = list()
+    for _ in xrange(count):
+        vertices_count = random_state.randint(3, 40)
+        angles = np.sort(random_state.uniform(0, 2 * np.pi, vertices_count))
+        radii = random_state.uniform(20, 200, vertices_count)
+        center = random_state.uniform(0, 2000, 2)
+        polygons.append(np.column_stack((center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles))))
+    return polygons
+
+
+class TestShapeCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.polygons = get_polygons(50, self.random_state)
+        self.collection = ShapeCollection(self.polygons)
+        self.shapely_polygons = [Polygon(p) for p in self.polygons]
+
+    def test_bounds(self):
+        for scale_level in (0, -2):
+            bounds = self.collection.get_bounds(scale_level)
+            for b, p in zip(bounds, self.shapely_polygons):
+                self.assertTrue(np.allclose(b, np.array(p.bounds) * pow(2, scale_level)))
+
+    def test_areas(self):
+        for scale_level in (0, -2):
+            expected = [p.area * pow(4, scale_level) for p in self.shapely_polygons]
+            self.assertTrue(np.allclose(self.collection.get_areas(scale_level), expected))
+
+    def test_contains_points(self):
+        points = self.random_state.uniform(-100, 2100, (2000, 2))
+        inside = self.collection.contains_points(points)
+        self.assertEqual(inside.shape, (2000, 50))
+        expected = np.array([[p.contains(Point(x, y)) for p in self.shapely_polygons] for x, y in points])
+        self.assertTrue(np.array_equal(inside, expected))
+        self.assertTrue(inside.any())
+        # points of a lower resolution level are rescaled to level 0 before the test
+        self.assertTrue(np.array_equal(self.collection.contains_points(points / 4, -2), expected))
+
+    def test_closed_rings(self):
+        closed = ShapeCollection([np.vstack((p, p[:1])) for p in self.polygons])
+        self.assertTrue(np.array_equal(closed.offsets, self.collection.offsets))
+        self.assertTrue(np.allclose(closed.get_areas(), self.collection.get_areas()))
+
+    def test_from_shapes(self):
+        shapes = [Shape(p.tolist()) for p in self.polygons[:10]]
+        collection = ShapeCollection.from_shapes(shapes)
+        self.assertIs(collection[3], shapes[3])
+        self.assertTrue(np.allclose(collection.get_areas(), [s.get_area() for s in shapes]))
+        self.assertTrue(np.allclose(collection.get_lengths(), [s.get_length() for s in shapes]))
+
+    def test_lazy_shapes(self):
+        self.assertAlmostEqual(self.collection[7].get_area(), self.shapely_polygons[7].area)
+
+    def test_empty_and_invalid(self):
+        empty = ShapeCollection([])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(empty.get_bounds().shape, (0, 4))
+        self.assertEqual(empty.contains_points([(0, 0)]).shape, (1, 0))
+        self.assertRaises(InvalidPolygonError, ShapeCollection, [[(0, 0), (1, 1)]])
+
+
+if __name__ == '__main__':
+    unittest.main()
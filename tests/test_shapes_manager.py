@@ -0,0 +1,236 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from shapely.geometry import Polygon, Point, box
+from shapely.ops import unary_union
+
+from odin.libs.regions_of_interest.shapes_manager import Shape, ShapesIndex
+from odin.libs.regions_of_interest.utils import fill_polygon_stripe, triangulate_polygon, get_triangles_areas
+
+
+# size of the memory block an array belongs to, views share the block of the array they come from
+def get_buffer_size(array):
+    while array.base is not None:
+        array = array.base
+    return array.nbytes
+
+
+class TestFullMask(unittest.TestCase):
+
+    def setUp(self):
+        angles = np.linspace(0, 2 * np.pi, 600, endpoint=False)
+        radii = 600 + 80 * np.sin(angles * 25)
+        self.shapes = [
+            # wavy outline with many short slanted edges
+            Shape(np.column_stack((2000 + radii * np.cos(angles), 2000 + radii * np.sin(angles))).tolist()),
+            # few long slanted edges crossing many stripes
+            Shape([(100, 100), (1300, 500), (200, 1100)]),
+            Shape([(0, 0), (900, 0), (900, 700), (0, 700)])
+        ]
+        self.output_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def test_striped_mask_matches_single_pass(self):
+        for shape in self.shapes:
+            for scale_level, tolerance in ((0, 0), (-1, 0), (0, 5)):
+                mask = shape.get_full_mask(scale_level, tolerance)
+                self.assertTrue(mask.any())
+                for stripe_height in (1, 37, 256, 4096):
+                    out = np.zeros(mask.shape, dtype=np.uint8)
+                    shape.get_full_mask(scale_level, tolerance, out=out, stripe_height=stripe_height)
+                    self.assertTrue(np.array_equal(out, mask), (scale_level, tolerance, stripe_height))
+
+    # long slanted edges crossing all the stripes must not grow the buffers beyond a single stripe
+    def test_stripes_memory_is_bounded(self):
+        shape = Shape([(0, 0), (20000, 10000), (0, 20000)])
+        box_height, box_width = shape.get_full_mask_shape()
+        stripes_count = 0
+        for y_offset, stripe in shape.iter_full_mask(stripe_height=1024):
+            self.assertEqual(stripe.shape, (min(1024, box_height - y_offset), box_width))
+            self.assertLessEqual(get_buffer_size(stripe), 1024 * box_width)
+            stripes_count += 1
+        self.assertEqual(stripes_count, 20)
+        mask = shape.get_full_mask(-2)
+        out = np.zeros(mask.shape, dtype=np.uint8)
+        self.assertTrue(np.array_equal(shape.get_full_mask(-2, out=out, stripe_height=100), mask))
+
+    def test_saved_mask_matches_single_pass(self):
+        out_file = os.path.join(self.output_folder, 'mask.npy')
+        for shape in self.shapes:
+            mask = shape.get_full_mask(-1)
+            saved_mask = shape.save_full_mask(out_file, -1, stripe_height=50)
+            self.assertEqual(saved_mask.shape, shape.get_full_mask_shape(-1))
+            self.assertTrue(np.array_equal(saved_mask, mask))
+            del saved_mask
+
+
+class TestSamplePoints(unittest.TestCase):
+
+    def setUp(self):
+        angles = np.linspace(0, 2 * np.pi, 3000, endpoint=False)
+        radii = 600 + 250 * np.sin(angles * 150) + 50 * np.random.RandomState(0).rand(3000)
+        teeth = [(x + dx, y) for x in xrange(0, 2000, 10) for dx, y in ((0, 0), (5, 1000))]
+        self.polygons = [
+            # concave polygons with few vertices, triangulated without splitting them
+            [(0, 0), (100, 0), (100, 100), (50, 20), (0, 100)],
+            [(0, 0), (30, 0), (30, 10), (10, 10), (10, 20), (30, 20), (30, 30), (0, 30)],
+            # thousands of vertices with deep concavities
+            np.column_stack((2000 + radii * np.cos(angles), 2000 + radii * np.sin(angles))).tolist(),
+            [(0, -10)] + teeth + [(2000, 0), (2000, -10)]
+        ]
+
+    def test_triangles_cover_polygon(self):
+        for coordinates in self.polygons:
+            polygon = Polygon(coordinates)
+            triangles = triangulate_polygon(coordinates)
+            self.assertTrue(np.all(get_triangles_areas(triangles) > 0))
+            self.assertAlmostEqual(get_triangles_areas(triangles).sum() / polygon.area, 1.0)
+            covered_area = unary_union([Polygon(t) for t in triangles])
+            self.assertAlmostEqual(covered_area.symmetric_difference(polygon).area / polygon.area, 0.0)
+
+    def test_points_are_inside_polygon(self):
+        for coordinates in self.polygons:
+            shape = Shape(coordinates)
+            points = shape.sample_points(500, seed=3)
+            self.assertEqual(points.shape, (500, 2))
+            self.assertTrue(np.array_equal(points, shape.sample_points(500, seed=3)))
+            contour = shape.polygon.buffer(1e-6)
+            self.assertTrue(all(contour.contains(Point(x, y)) for x, y in points))
+
+
+class TestFillPolygonStripe(unittest.TestCase):
+
+    # polygons with vertices on the borders of the image or outside of it, whose outline is clipped by cv2
+    def test_stripes_match_fill_poly(self):
+        random_state = np.random.RandomState(0)
+        for i in xrange(300):
+            width, height = random_state.randint(1, 100, 2)
+            vertices_count = random_state.randint(3, 12)
+            if i % 2:
+                xs = random_state.randint(-20, width + 20, vertices_count)
+                ys = random_state.randint(-20, height + 20, vertices_count)
+            else:
+                xs = random_state.choice([0, width, random_state.randint(0, width + 1)], vertices_count)
+                ys = random_state.choice([0, height, random_state.randint(0, height + 1)], vertices_count)
+            polygon_path = np.column_stack((xs, ys)).astype(np.int32)
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(mask, [polygon_path], 1)
+            for stripe_height in (1, 7, height):
+                out = np.zeros((height, width), dtype=np.uint8)
+                for y_offset in xrange(0, height, stripe_height):
+                    fill_polygon_stripe(out[y_offset:y_offset + stripe_height], polygon_path, y_offset, height)
+                self.assertTrue(np.array_equal(out, mask), (polygon_path.tolist(), width, height, stripe_height))
+
+
+def get_box(x, y, size):
+    return {
+        'up_left': (x, y),
+        'up_right': (x + size, y),
+        'down_right': (x + size, y + size),
+        'down_left': (x, y + size)
+    }
+
+
+class TestShapesIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.shapes = [
+            Shape([(100, 100), (900, 150), (700, 800)]),
+            # overlaps the first shape
+            Shape([(600, 500), (1400, 500), (1400, 1200), (600, 1200)]),
+            # concave, its envelope covers points that are outside of the polygon
+            Shape([(2000, 0), (3000, 0), (3000, 1000), (2500, 200), (2000, 1000)]),
+            Shape([(100, 2000), (400, 2100), (300, 2600)])
+        ]
+        self.random_state = np.random.RandomState(0)
+
+    def test_query_matches_envelopes(self):
+        for scale_level in (0, -1):
+            index = ShapesIndex(self.shapes, scale_level)
+            scaling = 2 ** scale_level
+            envelopes = [box(*Polygon(np.array(s.get_coordinates()) * scaling).bounds) for s in self.shapes]
+            for x, y in self.random_state.uniform(-200, 3200 * scaling, (200, 2)):
+                size = 150 * scaling
+                expected = [i for i, e in enumerate(envelopes) if e.intersects(box(x, y, x + size, y + size))]
+                self.assertEqual(index.query(get_box(x, y, size)), expected, (scale_level, x, y))
+
+    def test_query_point_matches_polygons(self):
+        index = ShapesIndex(self.shapes)
+        points = self.random_state.uniform(0, 3200, (500, 2)).tolist() + [(2500, 600), (1000, 800), (650, 550)]
+        for x, y in points:
+            expected = [i for i, s in enumerate(self.shapes) if s.polygon.intersects(Point(x, y))]
+            self.assertEqual(index.query_point(x, y), expected, (x, y))
+        # inside the envelope of the concave shape only
+        self.assertEqual(index.query_point(2500, 600), [])
+        self.assertEqual(index.query_point(650, 550), [0, 1])
+
+    def test_empty_index(self):
+        index = ShapesIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.query(get_box(0, 0, 100)), [])
+        self.assertEqual(index.query_point(10, 10), [])
+        self.assertEqual(index.get_coverage_fractions([get_box(0, 0, 100)]).tolist(), [0.0])
+
+
+class TestCoverageFractions(unittest.TestCase):
+
+    def setUp(self):
+        self.core = Shape([(0, 0), (1000, 0), (1000, 1000), (0, 1000)])
+        # two overlapping regions covering the core, the area they share must be counted once
+        self.regions = [Shape([(0, 0), (600, 0), (600, 1000), (0, 1000)]),
+                        Shape([(400, 0), (1000, 0), (1000, 1000), (400, 1000)]),
+                        Shape([(2000, 2000), (2400, 2000), (2200, 2300)])]
+
+    def test_known_layout(self):
+        boxes = [get_box(100, 100, 100), get_box(1500, 1500, 100), get_box(950, 300, 100),
+                 get_box(950, 950, 100), get_box(-100, -100, 200), get_box(350, 500, 300)]
+        self.assertTrue(np.allclose(self.core.get_coverage_fractions(boxes), [1.0, 0.0, 0.5, 0.25, 0.25, 1.0]))
+        # the last box is covered by the union of the regions but by none of them alone
+        index = ShapesIndex(self.regions)
+        self.assertTrue(np.allclose(index.get_coverage_fractions(boxes), [1.0, 0.0, 0.5, 0.25, 0.25, 1.0]))
+        self.assertTrue(np.allclose(ShapesIndex(self.regions[:1]).get_coverage_fractions(boxes),
+                                    [1.0, 0.0, 0.0, 0.0, 0.25, 250 / 300.0]))
+
+    def test_fractions_match_areas(self):
+        random_state = np.random.RandomState(0)
+        for scale_level in (0, -1):
+            scaling = 2 ** scale_level
+            index = ShapesIndex(self.regions, scale_level)
+            union = unary_union([Polygon(np.array(r.get_coordinates()) * scaling) for r in self.regions])
+            core = Polygon(np.array(self.core.get_coordinates()) * scaling)
+            size = 256 * scaling
+            boxes = [get_box(x, y, size) for x, y in random_state.uniform(-200, 2500 * scaling, (200, 2))]
+            expected_tissue = [core.intersection(box(*(b['up_left'] + b['down_right']))).area / size ** 2
+                               for b in boxes]
+            expected_regions = [union.intersection(box(*(b['up_left'] + b['down_right']))).area / size ** 2
+                                for b in boxes]
+            self.assertTrue(np.allclose(self.core.get_coverage_fractions(boxes, scale_level), expected_tissue))
+            self.assertTrue(np.allclose(index.get_coverage_fractions(boxes), expected_regions))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+from odin.libs.deepzoom.slides_pool import SlidesPool
+
+SLIDES_COUNT = 3
+
+
+def build_slide(slide_path, seed):
+    slide_img = np.random.RandomState(seed).randint(0, 256, (512, 512, 3)).astype(np.uint8)
+    with tifffile.TiffWriter(slide_path) as tiff_writer:
+        tiff_writer.save(slide_img, tile=(128, 128), photometric='rgb')
+
+
+class TestSlidesPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if tifffile is None:
+            raise unittest.SkipTest('tifffile is required to build the test slides')
+        cls.slides_folder = tempfile.mkdtemp()
+        cls.slides_paths = [os.path.join(cls.slides_folder, 'slide_%d.tiff' % i) for i in xrange(SLIDES_COUNT)]
+        for i, slide_path in enumerate(cls.slides_paths):
+            build_slide(slide_path, i)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slides_folder)
+
+    def test_slides_are_reused(self):
+        pool = SlidesPool()
+        slide = pool.get_slide(self.slides_paths[0])
+        self.assertIs(pool.get_slide(self.slides_paths[0]), slide)
+        self.assertIs(pool.get_deepzoom_generator(self.slides_paths[0], 128),
+                      pool.get_deepzoom_generator(self.slides_paths[0], 128))
+        pool.close_all()
+        self.assertEqual(pool.get_open_slides(), [])
+
+    # every slide accounts for at least one descriptor, with a limit of one only the last slide stays open
+    def test_least_recently_used_slides_are_closed(self):
+        pool = SlidesPool(max_open_files=1)
+        for slide_path in self.slides_paths:
+            pool.get_slide(slide_path)
+        self.assertEqual(pool.get_open_slides(), self.slides_paths[-1:])
+        self.assertLessEqual(pool.get_open_files(), 1)
+
+    def test_leased_slides_are_not_closed(self):
+        pool = SlidesPool(max_open_files=1)
+        with pool.lease_slide(self.slides_paths[0]) as slide:
+            pool.get_slide(self.slides_paths[1])
+            pool.close(self.slides_paths[0])
+            self.assertIn(self.slides_paths[0], pool.get_open_slides())
+            self.assertEqual(slide.read_region((0, 0), 0, (16, 16)).size, (16, 16))
+        # the close requested while the slide was leased is applied with the release of the lease
+        self.assertNotIn(self.slides_paths[0], pool.get_open_slides())
+
+    def test_concurrent_leases(self):
+        pool = SlidesPool(max_open_files=1)
+        errors = list()
+
+        def read_slides(seed):
+            random_state = np.random.RandomState(seed)
+            try:
+                for _ in xrange(50):
+                    slide_path = self.slides_paths[random_state.randint(SLIDES_COUNT)]
+                    with pool.lease_deepzoom_generator(slide_path, 128) as generator:
+                        generator.get_tile(generator.level_count - 1, (1, 1))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read_slides, args=(i,)) for i in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(pool.get_open_slides()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#  Copyright (c) 2019, CRS4
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of
+#  this software and associated documentation files (the "Software"), to deal in
+#  the Software without restriction, including without limitation the rights to
+#  use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+#  the Software, and to permit persons to whom the Software is furnished to do so,
+#  subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+#  FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+#  COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+#  IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+#  CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import unittest
+from PIL import Image
+
+from odin.libs.deepzoom.tiles_cache import TilesCache
+
+
+# an RGB tile of size x size pixels takes size * size * 4 bytes
+def get_tile(size=8, mode='RGB'):
+    return Image.new(mode, (size, size))
+
+
+class TestTilesCache(unittest.TestCase):
+
+    def test_tile_memory(self):
+        self.assertEqual(TilesCache._get_tile_memory(get_tile(8, 'RGB')), 256)
+        self.assertEqual(TilesCache._get_tile_memory(get_tile(8, 'RGBA')), 256)
+        self.assertEqual(TilesCache._get_tile_memory(get_tile(8, 'L')), 64)
+        self.assertEqual(TilesCache._get_tile_memory(get_tile(8, 'I;16')), 128)
+
+    def test_budget_eviction(self):
+        cache = TilesCache(memory_budget=3 * 256)
+        for i in xrange(3):
+            cache.put(i, get_tile())
+        self.assertEqual(cache.memory_usage, 3 * 256)
+        cache.put(3, get_tile())
+        self.assertIsNone(cache.get(0))
+        self.assertIsNotNone(cache.get(3))
+        stats = cache.get_stats()
+        self.assertEqual(stats['tiles'], 3)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['memory_usage'], stats['memory_budget'])
+
+    def test_lru_order(self):
+        cache = TilesCache(memory_budget=3 * 256)
+        for i in xrange(3):
+            cache.put(i, get_tile())
+        # reading a tile makes it the most recently used one, the oldest one left is evicted
+        cache.get(0)
+        cache.put(3, get_tile())
+        self.assertIsNotNone(cache.get(0))
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(2))
+
+    def test_bigger_tile_evicts_more_tiles(self):
+        cache = TilesCache(memory_budget=4 * 256)
+        for i in xrange(4):
+            cache.put(i, get_tile())
+        cache.put('big', get_tile(16))
+        self.assertEqual(cache.get_stats()['tiles'], 1)
+        self.assertEqual(cache.get_stats()['evictions'], 4)
+        self.assertEqual(cache.memory_usage, 4 * 256)
+
+    def test_tile_over_budget_is_not_cached(self):
+        cache = TilesCache(memory_budget=256)
+        cache.put(0, get_tile())
+        cache.put(1, get_tile(9))
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(0))
+
+    def test_replace_tile(self):
+        cache = TilesCache(memory_budget=4 * 256)
+        cache.put(0, get_tile())
+        cache.put(0, get_tile(16))
+        self.assertEqual(cache.memory_usage, 4 * 256)
+        self.assertEqual(cache.get(0).size, (16, 16))
+
+    def test_stats_and_clear(self):
+        cache = TilesCache()
+        cache.put(0, get_tile())
+        cache.get(0)
+        cache.get(0)
+        cache.get(1)
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 0))
+        cache.clear()
+        self.assertEqual(cache.get_stats()['tiles'], 0)
+        self.assertEqual(cache.memory_usage, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()